@@ -1,20 +1,90 @@
 
+import codecs
+import csv
+import gzip
+import hashlib
+import json
 import os
+import pickle
+import queue
+import re
+import shutil
 import sqlite3
-from flask import Flask, request, render_template_string
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from flask import (Flask, request, render_template, jsonify, abort, url_for, g, has_request_context,
+                   make_response)
+import numpy as np
 import pandas as pd
-import plotly.graph_objs as go
-import plotly.io as pio
+from numpy.lib.stride_tricks import sliding_window_view
 from werkzeug.utils import secure_filename
 import uuid
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime, timedelta, timezone
+import click
+
+try:
+    import brotli
+except ImportError:  # responses are gzipped instead
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # only needed once cold data is archived to Parquet
+    pa = ds = pq = None
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB
+app.config['CHART_MAX_POINTS'] = 2000  # voltage trace budget, roughly the chart width in pixels
+app.config['RESULT_CACHE_BYTES'] = 64 * 1024 * 1024  # per-process cache of search and chart results
+app.config['ARCHIVE_FOLDER'] = 'archive'  # Parquet files holding cold gps_data months
+app.config['ARCHIVE_AFTER_DAYS'] = 180  # default age at which `flask archive-gps` moves months out
+app.config['SLOW_REQUEST_SECONDS'] = 1.0  # requests slower than this are logged with their stage timings
+app.config['SLOW_IMPORT_SECONDS'] = 60.0  # likewise for background imports
+app.config['COMPRESS_MIN_BYTES'] = 1024  # smaller responses are sent uncompressed
+app.config['COMPARE_MAX_DEVICES'] = 50  # devices in one /tracker comparison
+app.config['COMPARE_CHART_POINTS'] = 300  # voltage points per device in the comparison chart
+app.config['OFFLINE_GAP_MINUTES'] = 60  # gaps between readings at least this long are kept in offline_periods
+app.config['OFFLINE_AFTER_HOURS'] = 24  # default silence after which a device counts as offline
 
 DB_NAME = 'gps_data.db'
+# Part of every data ETag, so a deploy with new templates or payloads invalidates them
+with open(__file__, 'rb') as _source:
+    CODE_VERSION = hashlib.sha1(_source.read()).hexdigest()[:12]
+EPOCH = pd.Timestamp(0)
+CHARGE_MERGE_GAP = np.timedelta64(60, 'm')  # rises closer than this are one charge cycle
+LONG_OFFLINE_DAYS = 2  # a charge cycle spanning this long means the device was offline
+CSV_CHUNK_ROWS = 50000  # telemetry rows parsed and written per transaction
+DATE_SAMPLE_ROWS = 1000  # tracking dates checked when sniffing an upload's date format
+ARCHIVE_BUCKETS = 16  # device hash buckets per archived month
+ARCHIVE_ROW_GROUP_ROWS = 64 * 1024  # rows per Parquet row group, the unit of predicate pushdown
+EXPORT_BATCH_ROWS = 50000  # rows fetched and encoded per chunk of a streamed export
+UPLOAD_SNIFF_BYTES = 64 * 1024  # head of an upload read to detect its encoding, delimiter and columns
+UPLOAD_DELIMITERS = ',;\t|'
+UPLOAD_KINDS = {'telemetry': 'a telemetry file', 'device_info': 'a device metadata file'}
+
+GPS_COLUMN_MAPPING = {'sl._no': 'sl_no', 'event_type': 'event'}
+GPS_REQUIRED_COLUMNS = ['sl_no', 'device', 'event', 'tracking_date', 'battery_voltage']
+DEVICE_INFO_COLUMN_MAPPING = {'device_id': 'device'}
+DEVICE_INFO_COLUMNS = ['region', 'branch', 'sim_type']  # each optional in a metadata upload
+
+# Explicit tracking date layouts tried when sniffing an upload, month-first
+# then day-first; the order selected on the upload form is tried first so it
+# wins when a sample fits both (every day <= 12).
+MONTH_FIRST_FORMATS = ['%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M',
+                       '%m-%d-%Y %I:%M:%S %p', '%m-%d-%Y %H:%M:%S']
+DAY_FIRST_FORMATS = ['%d/%m/%Y %I:%M:%S %p', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M',
+                     '%d-%m-%Y %I:%M:%S %p', '%d-%m-%Y %H:%M:%S']
+ISO_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M']
 
 LANDING_TEMPLATE = """
 <!doctype html>
@@ -276,14 +346,20 @@ TRACKER_TEMPLATE = """
     </div>
   </div>
 
-  {% if upload_success %}
-    <div class="alert alert-success">✅ File uploaded and data imported successfully.</div>
+  {% if error_message %}
+    <div class="alert alert-danger">{{ error_message }}</div>
+  {% endif %}
+
+  {% if job_id %}
+    <div class="alert alert-info" id="import-status" data-job-url="{{ url_for('job_status', job_id=job_id) }}">
+      ⏳ Import queued…
+    </div>
   {% endif %}
 
   <div class="card mb-4">
     <div class="card-header">Device Search</div>
     <div class="card-body">
-      <form method="post">
+      <form method="get">
         <div class="mb-3">
           <label class="form-label">Device ID</label>
           <input type="text" class="form-control" name="device" required value="{{ device_prefill or '' }}">
@@ -291,11 +367,13 @@ TRACKER_TEMPLATE = """
         <div class="row">
           <div class="col-md-6 mb-3">
             <label class="form-label">From Date</label>
-            <input type="text" class="form-control datepicker" name="from_date" placeholder="dd/mm/yyyy" required>
+            <input type="text" class="form-control datepicker" name="from_date" placeholder="dd/mm/yyyy" required
+                   value="{{ request.args.get('from_date', '') }}">
           </div>
           <div class="col-md-6 mb-3">
             <label class="form-label">To Date</label>
-            <input type="text" class="form-control datepicker" name="to_date" placeholder="dd/mm/yyyy" required>
+            <input type="text" class="form-control datepicker" name="to_date" placeholder="dd/mm/yyyy" required
+                   value="{{ request.args.get('to_date', '') }}">
           </div>
         </div>
         <button class="btn btn-success" type="submit">Search</button>
@@ -303,6 +381,123 @@ TRACKER_TEMPLATE = """
     </div>
   </div>
 
+  <div class="card mb-4">
+    <div class="card-header">Compare Devices</div>
+    <div class="card-body">
+      <form method="get">
+        <input type="hidden" name="compare" value="1">
+        <div class="mb-3">
+          <label class="form-label">Device IDs</label>
+          <textarea class="form-control" name="devices" rows="2"
+                    placeholder="Separated by commas, spaces or new lines">{{ request.args.get('devices', '') }}</textarea>
+        </div>
+        <div class="row">
+          <div class="col-md-6 mb-3">
+            <label class="form-label">Or every device in Region</label>
+            <select class="form-select" name="region" id="compare-region"
+                    data-selected="{{ request.args.get('region', '') }}">
+              <option value="">Select Region</option>
+            </select>
+          </div>
+          <div class="col-md-6 mb-3">
+            <label class="form-label">Branch</label>
+            <select class="form-select" name="branch" id="compare-branch"
+                    data-selected="{{ request.args.get('branch', '') }}" disabled>
+              <option value="">Select Branch</option>
+            </select>
+          </div>
+        </div>
+        <div class="row">
+          <div class="col-md-6 mb-3">
+            <label class="form-label">From Date</label>
+            <input type="text" class="form-control datepicker" name="from_date" placeholder="dd/mm/yyyy" required
+                   value="{{ request.args.get('from_date', '') }}">
+          </div>
+          <div class="col-md-6 mb-3">
+            <label class="form-label">To Date</label>
+            <input type="text" class="form-control datepicker" name="to_date" placeholder="dd/mm/yyyy" required
+                   value="{{ request.args.get('to_date', '') }}">
+          </div>
+        </div>
+        <button class="btn btn-success" type="submit">Compare</button>
+      </form>
+    </div>
+  </div>
+
+  {% if comparison %}
+    <div class="card mb-4">
+      <div class="card-header">Comparison: {{ comparison['label'] }}</div>
+      <div class="card-body">
+        <p>
+          <strong>From Date:</strong> {{ comparison['from_date'] }}
+          <strong class="ms-3">To Date:</strong> {{ comparison['to_date'] }}
+          {% if comparison['total'] > comparison['devices']|length %}
+            <span class="badge bg-warning text-dark ms-2">
+              Showing the first {{ comparison['devices']|length }} of {{ comparison['total'] }} devices
+            </span>
+          {% endif %}
+        </p>
+        <div class="table-responsive">
+          <table class="table table-striped table-sm">
+            <thead>
+              <tr>
+                <th>Device</th>
+                <th>Region</th>
+                <th>Branch</th>
+                <th>Days Active</th>
+                <th>Total Pings</th>
+                <th>Charges</th>
+                <th>Long Offline</th>
+                <th>Offline {{ config['OFFLINE_AFTER_HOURS'] }}h+</th>
+                <th>Longest Gap</th>
+                <th>Voltage Range</th>
+                <th>Last Active</th>
+              </tr>
+            </thead>
+            <tbody>
+              {% for row in comparison['devices'] %}
+              <tr>
+                <td><a href="{{ url_for('tracker', device=row['device'], from_date=comparison['from_date'], to_date=comparison['to_date']) }}">{{ row['device'] }}</a></td>
+                <td>{{ row['region'] or '' }}</td>
+                <td>{{ row['branch'] or '' }}</td>
+                <td>{{ row['days'] }}</td>
+                <td>{{ row['pings'] }}</td>
+                <td>{{ row['charges'] }}</td>
+                <td>
+                  {% if row['long_offline_count'] > 0 %}
+                    <span class="badge bg-danger">{{ row['long_offline_count'] }}</span>
+                  {% else %}
+                    0
+                  {% endif %}
+                </td>
+                <td>{{ row['offline_periods'] }}</td>
+                <td>{{ row['longest_gap'] or '' }}</td>
+                <td>
+                  {% if row['min_voltage'] is not none %}
+                    {{ "%.2f"|format(row['min_voltage']) }}V – {{ "%.2f"|format(row['max_voltage']) }}V
+                  {% endif %}
+                </td>
+                <td>{{ row['last_day'] or 'No data' }}</td>
+              </tr>
+              {% endfor %}
+            </tbody>
+          </table>
+        </div>
+        <p>
+          <strong>Download CSV:</strong>
+          <a href="{{ url_for('export', dataset='pings', **comparison['export_args']) }}">Pings</a> ·
+          <a href="{{ url_for('export', dataset='daily', **comparison['export_args']) }}">Daily Summary</a> ·
+          <a href="{{ url_for('export', dataset='charges', **comparison['export_args']) }}">Charge Cycles</a>
+        </p>
+        <div class="chart-container">
+          <div id="comparison-chart" data-timeseries-url="{{ comparison['timeseries_url'] }}">
+            <div class="text-muted">Loading chart…</div>
+          </div>
+        </div>
+      </div>
+    </div>
+  {% endif %}
+
   {% if result %}
     <div class="card mb-4">
       <div class="card-header">Results</div>
@@ -326,8 +521,17 @@ TRACKER_TEMPLATE = """
                 </span>
               {% endif %}
             </p>
+            <p><strong>Offline Periods:</strong> {{ result['offline_periods']|length }}
+              <span class="text-muted small">(no pings for {{ config['OFFLINE_AFTER_HOURS'] }}+ hours)</span>
+            </p>
           </div>
         </div>
+        <p class="mb-0">
+          <strong>Download CSV:</strong>
+          <a href="{{ url_for('export', dataset='pings', **result['export_args']) }}">Pings</a> ·
+          <a href="{{ url_for('export', dataset='daily', **result['export_args']) }}">Daily Summary</a> ·
+          <a href="{{ url_for('export', dataset='charges', **result['export_args']) }}">Charge Cycles</a>
+        </p>
        
         {% if result['charge_details'] %}
         <div class="mt-4">
@@ -370,17 +574,50 @@ TRACKER_TEMPLATE = """
           </div>
         </div>
         {% endif %}
+
+        {% if result['offline_periods'] %}
+        <div class="mt-4">
+          <h5>Offline Periods</h5>
+          <div class="table-responsive">
+            <table class="table table-striped">
+              <thead>
+                <tr>
+                  <th>#</th>
+                  <th>Last Ping</th>
+                  <th>Next Ping</th>
+                  <th>Offline For</th>
+                </tr>
+              </thead>
+              <tbody>
+                {% for period in result['offline_periods'] %}
+                <tr>
+                  <td>{{ loop.index }}</td>
+                  <td>{{ period['last_seen'] }}</td>
+                  <td>{{ period['back_online'] }}</td>
+                  <td><span class="badge bg-danger">{{ period['duration'] }}</span></td>
+                </tr>
+                {% endfor %}
+              </tbody>
+            </table>
+          </div>
+        </div>
+        {% endif %}
       </div>
     </div>
   {% endif %}
 
-  {% if combined_chart %}
+  {% if result %}
     <div class="card">
       <div class="card-header">Activity Summary</div>
       <div class="card-body">
         <div class="chart-container">
-          {{ combined_chart | safe }}
+          <div id="activity-chart"
+               data-timeseries-url="{{ result['timeseries_url'] }}"
+               data-charges-url="{{ result['charges_url'] }}">
+            <div class="text-muted">Loading chart…</div>
+          </div>
         </div>
+        <p id="voltage-points" class="text-muted small mb-0"></p>
       </div>
     </div>
   {% endif %}
@@ -392,6 +629,257 @@ TRACKER_TEMPLATE = """
     allowInput: true
   });
 </script>
+{% if job_id %}
+<script src="{{ url_for('static', filename='import_status.js') }}"></script>
+{% endif %}
+<script>
+  // Region and branch choices for the comparison form
+  (function () {
+    const region = document.getElementById('compare-region');
+    const branch = document.getElementById('compare-branch');
+    const fill = (select, items, key) => {
+      items.forEach(item => {
+        const option = new Option(`${item[key]} (${item.count})`, item[key]);
+        option.selected = item[key] === select.dataset.selected;
+        select.add(option);
+      });
+    };
+    function loadBranches() {
+      branch.length = 1;
+      branch.disabled = !region.value;
+      if (!region.value) return;
+      fetch(`/api/branches?region=${encodeURIComponent(region.value)}`)
+        .then(r => r.json()).then(items => fill(branch, items, 'branch'));
+    }
+    region.addEventListener('change', () => {
+      branch.dataset.selected = '';
+      loadBranches();
+    });
+    fetch('/api/regions').then(r => r.json()).then(items => {
+      fill(region, items, 'region');
+      loadBranches();
+    });
+  })();
+</script>
+{% if result or comparison %}
+<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>
+{% endif %}
+{% if result %}
+<script>
+  // Timestamps from the API are epoch seconds of local wall-clock time, so read them as UTC
+  const MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+  const pad = n => String(n).padStart(2, '0');
+  const toDate = seconds => new Date(seconds * 1000).toISOString().slice(0, 19);
+  const monthKey = seconds => {
+    const d = new Date(seconds * 1000);
+    return d.getUTCFullYear() * 12 + d.getUTCMonth();
+  };
+
+  function formatDateTime(seconds) {
+    const d = new Date(seconds * 1000);
+    const hours = d.getUTCHours();
+    return `${pad(d.getUTCDate())}-${pad(d.getUTCMonth() + 1)}-${d.getUTCFullYear()} ` +
+           `${pad(hours % 12 || 12)}:${pad(d.getUTCMinutes())} ${hours < 12 ? 'AM' : 'PM'}`;
+  }
+
+  function renderActivityChart(el, series, charges, title) {
+    const daily = series.daily;
+    if (daily.day.length === 0) {
+      el.innerHTML = '<div class="text-muted">No ping data in this range.</div>';
+      return;
+    }
+
+    const traces = [{
+      type: 'bar',
+      x: daily.day.map(toDate),
+      y: daily.pings,
+      name: 'Ping Count',
+      marker: {color: 'rgba(54, 162, 235, 0.7)'},
+      yaxis: 'y',
+      hovertemplate: 'Date: %{x}<br>Pings: %{y}<extra></extra>'
+    }];
+
+    if (series.voltage.ts.length) {
+      traces.push({
+        type: 'scatter',
+        mode: 'lines',
+        x: series.voltage.ts.map(toDate),
+        y: series.voltage.v,
+        name: 'Battery Voltage',
+        line: {color: 'orange', width: 2},
+        yaxis: 'y2',
+        hovertemplate: 'Date: %{x|%d-%m-%Y %I:%M %p}<br>Voltage: %{y:.2f}V<extra></extra>'
+      });
+    }
+
+    if (charges.start_ts.length) {
+      const x = [], y = [], text = [];
+      charges.start_ts.forEach((start, i) => {
+        const end = charges.end_ts[i];
+        x.push(toDate(start), toDate(end));
+        y.push(charges.start_voltage[i], charges.max_voltage[i]);
+        text.push(`Start Voltage: ${charges.start_voltage[i].toFixed(2)}V<br>Date: ${formatDateTime(start)}`,
+                  `Max Voltage: ${charges.max_voltage[i].toFixed(2)}V<br>Date: ${formatDateTime(end)}`);
+      });
+      traces.push({
+        type: 'scatter',
+        mode: 'markers',
+        x: x,
+        y: y,
+        name: 'Charge Min/Max Points',
+        marker: {color: 'orange', size: 8, symbol: 'circle'},
+        yaxis: 'y2',
+        text: text,
+        hoverinfo: 'text'
+      });
+    }
+
+    // More than 2 months - label monthly ticks with ping and charge counts
+    const minDay = daily.day[0];
+    const maxDay = daily.day[daily.day.length - 1];
+    let xaxis = {title: {text: 'Date'}, tickformat: '%d %b', tickangle: 45};
+    const shapes = [];
+    if ((maxDay - minDay) / 86400 > 60) {
+      const monthlyPings = new Map();
+      const monthlyCharges = new Map();
+      daily.day.forEach((day, i) => {
+        const key = monthKey(day);
+        monthlyPings.set(key, (monthlyPings.get(key) || 0) + daily.pings[i]);
+      });
+      charges.start_ts.forEach(start => {
+        const key = monthKey(start);
+        monthlyCharges.set(key, (monthlyCharges.get(key) || 0) + 1);
+      });
+
+      const months = [...new Set([...monthlyPings.keys(), ...monthlyCharges.keys()])].sort((a, b) => a - b);
+      const tickvals = [];
+      const ticktext = [];
+      months.forEach(key => {
+        const year = Math.floor(key / 12);
+        const month = key % 12;
+        tickvals.push(`${year}-${pad(month + 1)}-15T12:00:00`);
+        ticktext.push(`${MONTHS[month]} ${year}<br>Pings: ${monthlyPings.get(key) || 0} | Charges: ${monthlyCharges.get(key) || 0}`);
+
+        // Vertical lines for month starts
+        const monthStart = Date.UTC(year, month, 1) / 1000;
+        if (monthStart > minDay) {
+          shapes.push({
+            type: 'line', xref: 'x', yref: 'paper', x0: toDate(monthStart), x1: toDate(monthStart), y0: 0, y1: 1,
+            line: {color: 'gray', width: 1, dash: 'dot'}, opacity: 0.5
+          });
+        }
+      });
+      xaxis = {title: {text: 'Month'}, tickvals: tickvals, ticktext: ticktext, tickangle: 0, tickfont: {size: 10}};
+    }
+
+    el.innerHTML = '';
+    Plotly.newPlot(el, traces, {
+      title: {text: title, x: 0.5},
+      xaxis: xaxis,
+      yaxis: {title: {text: 'Ping Count'}, side: 'left', showgrid: false},
+      yaxis2: {title: {text: 'Battery Voltage (V)'}, overlaying: 'y', side: 'right', showgrid: false, range: [2.8, 4.4]},
+      shapes: shapes,
+      legend: {orientation: 'h', y: 1.1, x: 1, xanchor: 'right'},
+      margin: {l: 40, r: 40, t: 50, b: 120},
+      height: 450,
+      dragmode: false
+    }, {
+      modeBarButtonsToRemove: ['select2d', 'lasso2d'],
+      scrollZoom: false,
+      displayModeBar: true,
+      displaylogo: false
+    });
+  }
+
+  (function () {
+    const el = document.getElementById('activity-chart');
+    const getJSON = url => fetch(url).then(r => {
+      if (!r.ok) throw new Error(`${url}: ${r.status}`);
+      return r.json();
+    });
+
+    Promise.all([getJSON(el.dataset.timeseriesUrl), getJSON(el.dataset.chargesUrl)])
+      .then(([series, charges]) => {
+        renderActivityChart(el, series, charges, 'Activity Summary');
+        const shown = series.voltage_points_shown;
+        const total = series.voltage_points;
+        if (total) {
+          document.getElementById('voltage-points').textContent =
+            `Battery voltage: showing ${shown} of ${total} readings` +
+            (shown < total ? ' (downsampled; charge start/max points kept)' : '');
+        }
+      })
+      .catch(err => {
+        el.innerHTML = '<div class="text-danger">Could not load chart data.</div>';
+        console.error(err);
+      });
+  })();
+</script>
+{% endif %}
+{% if comparison %}
+<script>
+  // Small multiples: one voltage panel per device, sharing the time axis
+  (function () {
+    const el = document.getElementById('comparison-chart');
+    const toDate = seconds => new Date(seconds * 1000).toISOString().slice(0, 19);
+
+    fetch(el.dataset.timeseriesUrl).then(r => {
+      if (!r.ok) throw new Error(`${el.dataset.timeseriesUrl}: ${r.status}`);
+      return r.json();
+    }).then(data => {
+      const columns = data.devices.length > 1 ? 2 : 1;
+      const rows = Math.ceil(data.devices.length / columns);
+      const traces = [];
+      const annotations = [];
+      const layout = {
+        grid: {rows: rows, columns: columns, pattern: 'independent', ygap: 0.45},
+        showlegend: false,
+        margin: {l: 40, r: 20, t: 30, b: 40},
+        height: 60 + rows * 170,
+        dragmode: false
+      };
+
+      data.devices.forEach((series, i) => {
+        const suffix = i === 0 ? '' : String(i + 1);
+        const axes = {xaxis: `x${suffix}`, yaxis: `y${suffix}`};
+        traces.push({
+          type: 'scatter',
+          mode: 'lines',
+          x: series.voltage.ts.map(toDate),
+          y: series.voltage.v,
+          line: {color: 'orange', width: 1.5},
+          hovertemplate: `${series.device}<br>%{x|%d-%m-%Y %I:%M %p}<br>%{y:.2f}V<extra></extra>`,
+          ...axes
+        });
+        traces.push({
+          type: 'scatter',
+          mode: 'markers',
+          x: series.charges.start_ts.map(toDate),
+          y: series.charges.start_voltage,
+          marker: {color: 'rgba(54, 162, 235, 0.9)', size: 6},
+          hovertemplate: `${series.device}<br>Charge from %{y:.2f}V<br>%{x|%d-%m-%Y %I:%M %p}<extra></extra>`,
+          ...axes
+        });
+        layout[`xaxis${suffix}`] = {matches: i === 0 ? undefined : 'x', tickformat: '%d %b', tickfont: {size: 9}};
+        layout[`yaxis${suffix}`] = {range: [2.8, 4.4], tickfont: {size: 9}};
+        annotations.push({
+          text: `<b>${series.device}</b> · ${series.charges.start_ts.length} charge(s)` +
+                (series.voltage_points ? '' : ' · no data'),
+          xref: `x${suffix} domain`, yref: `y${suffix} domain`, x: 0, y: 1,
+          xanchor: 'left', yanchor: 'bottom', showarrow: false, font: {size: 11}
+        });
+      });
+      layout.annotations = annotations;
+
+      el.innerHTML = '';
+      Plotly.newPlot(el, traces, layout, {displayModeBar: false});
+    }).catch(err => {
+      el.innerHTML = '<div class="text-danger">Could not load chart data.</div>';
+      console.error(err);
+    });
+  })();
+</script>
+{% endif %}
 </body>
 </html>"""
 
@@ -531,8 +1019,14 @@ REGION_TEMPLATE = """
         </div>
       </div>
 
-      {% if upload_success %}
-        <div class="alert alert-success">✅ File uploaded and device info imported successfully.</div>
+      {% if error_message %}
+        <div class="alert alert-danger">{{ error_message }}</div>
+      {% endif %}
+
+      {% if job_id %}
+        <div class="alert alert-info" id="import-status" data-job-url="{{ url_for('job_status', job_id=job_id) }}">
+          ⏳ Import queued…
+        </div>
       {% endif %}
 
       <!-- Device Filter Card -->
@@ -557,6 +1051,7 @@ REGION_TEMPLATE = """
           <div class="mb-3">
             <label class="form-label">Devices in Selected Branch</label>
             <ul class="list-group" id="device-list"></ul>
+            <button type="button" class="btn btn-outline-secondary btn-sm mt-2 d-none" id="load-more">Load more</button>
           </div>
         </div>
       </div>
@@ -565,97 +1060,460 @@ REGION_TEMPLATE = """
 </div>
 
 <script>
-  const data = {{ data|tojson }};
   const regionSelect = document.getElementById('region-select');
   const branchSelect = document.getElementById('branch-select');
   const deviceList = document.getElementById('device-list');
+  const loadMore = document.getElementById('load-more');
+  let nextPage = null;
 
-  // Initialize regions
-  const regions = [...new Set(data.map(item => item.region))].filter(r => r);
-  regions.forEach(region => {
+  function getJSON(url, params) {
+    return fetch(`${url}?${new URLSearchParams(params)}`).then(r => {
+      if (!r.ok) throw new Error(`${url}: ${r.status}`);
+      return r.json();
+    });
+  }
+
+  function addOption(select, value) {
     const option = document.createElement('option');
-    option.value = region;
-    option.text = region;
-    regionSelect.appendChild(option);
-  });
+    option.value = value;
+    option.text = value;
+    select.appendChild(option);
+  }
+
+  // Initialize regions
+  getJSON('/api/regions', {}).then(regions => regions.forEach(r => addOption(regionSelect, r.region)));
 
   function updateBranches() {
     branchSelect.innerHTML = '<option value="">-- Select Branch --</option>';
     deviceList.innerHTML = '';
+    loadMore.classList.add('d-none');
     document.getElementById('branch-count').textContent = '';
 
     const selectedRegion = regionSelect.value;
     if (!selectedRegion) return;
 
-    const branches = [...new Set(data
-      .filter(item => item.region === selectedRegion && item.branch)
-      .map(item => item.branch))];
-
-    branches.forEach(branch => {
-      const option = document.createElement('option');
-      option.value = branch;
-      option.text = branch;
-      branchSelect.appendChild(option);
+    getJSON('/api/branches', {region: selectedRegion}).then(branches => {
+      if (regionSelect.value !== selectedRegion) return;
+      branches.forEach(b => addOption(branchSelect, b.branch));
+      document.getElementById('branch-count').textContent =
+        `${branches.length} ${branches.length === 1 ? 'branch' : 'branches'} found`;
     });
-
-    document.getElementById('branch-count').textContent =
-      `${branches.length} ${branches.length === 1 ? 'branch' : 'branches'} found`;
   }
 
   function updateDevices() {
     deviceList.innerHTML = '';
+    loadMore.classList.add('d-none');
+    nextPage = null;
+    if (!regionSelect.value || !branchSelect.value) return;
+    loadDevices(1);
+  }
+
+  function loadDevices(page) {
     const selectedRegion = regionSelect.value;
     const selectedBranch = branchSelect.value;
-   
-    if (!selectedRegion || !selectedBranch) return;
-
-    const filtered = data.filter(item =>
-      item.region === selectedRegion &&
-      item.branch === selectedBranch &&
-      item.device
-    );
-
-    if (filtered.length === 0) {
-      const li = document.createElement('li');
-      li.className = 'list-group-item text-muted';
-      li.textContent = 'No devices found.';
-      deviceList.appendChild(li);
-    } else {
-      filtered.forEach(item => {
+
+    getJSON('/api/devices', {region: selectedRegion, branch: selectedBranch, page: page}).then(result => {
+      if (regionSelect.value !== selectedRegion || branchSelect.value !== selectedBranch) return;
+
+      if (result.total === 0) {
+        const li = document.createElement('li');
+        li.className = 'list-group-item text-muted';
+        li.textContent = 'No devices found.';
+        deviceList.appendChild(li);
+      }
+      result.devices.forEach(item => {
         const li = document.createElement('li');
         li.className = 'list-group-item d-flex justify-content-between align-items-center';
-        li.innerHTML = `
-          <a href="/tracker?device=${encodeURIComponent(item.device)}" class="text-decoration-none">${item.device}</a>
-          <span class="badge bg-secondary">${item.sim_type || 'N/A'}</span>
-        `;
+        const link = document.createElement('a');
+        link.href = `/tracker?device=${encodeURIComponent(item.device)}`;
+        link.className = 'text-decoration-none';
+        link.textContent = item.device;
+        const badge = document.createElement('span');
+        badge.className = 'badge bg-secondary';
+        badge.textContent = item.sim_type || 'N/A';
+        li.append(link, badge);
         deviceList.appendChild(li);
       });
-    }
+
+      nextPage = result.page * result.per_page < result.total ? result.page + 1 : null;
+      loadMore.classList.toggle('d-none', nextPage === null);
+      loadMore.textContent = `Load more (${deviceList.children.length} of ${result.total})`;
+    });
   }
+
+  loadMore.addEventListener('click', () => nextPage && loadDevices(nextPage));
 </script>
+{% if job_id %}
+<script src="{{ url_for('static', filename='import_status.js') }}"></script>
+{% endif %}
 </body>
 </html>"""
 
+# Compiled once at startup; render_template() takes the Template objects directly
+LANDING_PAGE = app.jinja_env.from_string(LANDING_TEMPLATE)
+TRACKER_PAGE = app.jinja_env.from_string(TRACKER_TEMPLATE)
+REGION_PAGE = app.jinja_env.from_string(REGION_TEMPLATE)
+
+_static_pages = {}
+
+def static_page(template):
+    """Serve a page without per-request content from bytes rendered on first
+    use, gzipped when the client accepts it, with validators so repeat
+    visits get a 304."""
+    page = _static_pages.get(template)
+    if page is None:
+        body = render_template(template).encode()
+        page = _static_pages[template] = {
+            'identity': body,
+            'gzip': gzip.compress(body, compresslevel=9),
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+        }
+
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+    response = app.response_class(page[encoding], mimetype='text/html')
+    if encoding == 'gzip':
+        response.content_encoding = 'gzip'
+    response.set_etag(f"{page['etag']}-{encoding}")
+    response.last_modified = page['last_modified']
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',     # readers keep serving while an import writes
+    'PRAGMA synchronous=NORMAL',   # durable enough under WAL, far fewer fsyncs
+    'PRAGMA mmap_size=268435456',  # 256 MB of the file read through mmap
+    'PRAGMA cache_size=-65536',    # 64 MB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+)
+
+_db = threading.local()
+
+def get_db():
+    """This thread's SQLite connection, opened once and reused.
+
+    Use it as `with get_db() as conn:` to commit (or roll back) a transaction;
+    the connection itself stays open. A forked worker opens its own.
+    """
+    conn = getattr(_db, 'conn', None)
+    if conn is None or _db.pid != os.getpid():
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _db.conn, _db.pid = conn, os.getpid()
+    return conn
+
+def row_cursor(conn):
+    """A cursor returning sqlite3.Row, leaving the shared connection's row factory alone."""
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    return cur
+
+# Request and hot-path stage metrics, kept per worker process and served at
+# /metrics in the Prometheus text format.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+IMPORT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METRIC_HELP = {
+    'asset_tracker_request_seconds': ('histogram', 'Request latency by endpoint.'),
+    'asset_tracker_response_bytes': ('histogram', 'Response body size by endpoint.'),
+    'asset_tracker_requests_total': ('counter', 'Requests by endpoint and status.'),
+    'asset_tracker_stage_seconds': ('histogram', 'Duration of timed hot-path stages.'),
+    'asset_tracker_stage_rows_total': ('counter', 'Rows handled by timed hot-path stages.'),
+    'asset_tracker_import_seconds': ('histogram', 'Duration of background imports.'),
+    'asset_tracker_import_rows_total': ('counter', 'Rows read, inserted, rejected and refused as archived by imports.'),
+    'asset_tracker_export_rows_total': ('counter', 'Rows streamed by exports.'),
+}
+
+_histograms = {}  # (name, labels) -> [buckets, per-bucket counts (+Inf last), sum, count]
+_counters = {}  # (name, labels) -> total
+_metrics_lock = threading.Lock()
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+        entry[1][bisect_left(buckets, value)] += 1
+        entry[2] += value
+        entry[3] += 1
+
+def increment(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def stage(name, trace=None):
+    """Time a hot-path stage into asset_tracker_stage_seconds.
+
+    Set 'rows' and 'bytes' on the yielded dict to record what the stage
+    handled. The entry is also appended to `trace`, which defaults to the
+    current request's, for the slow request log.
+    """
+    info = {'stage': name}
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        info['seconds'] = time.perf_counter() - started
+        observe('asset_tracker_stage_seconds', info['seconds'], stage=name)
+        if 'rows' in info:
+            increment('asset_tracker_stage_rows_total', info['rows'], stage=name)
+        if trace is None and has_request_context():
+            trace = g.setdefault('stages', [])
+        if trace is not None:
+            trace.append(info)
+
+def summarize_stages(trace):
+    """Total seconds, rows and bytes per stage name, for log entries."""
+    summary = {}
+    for info in trace:
+        totals = summary.setdefault(info['stage'], {'calls': 0, 'seconds': 0.0})
+        totals['calls'] += 1
+        totals['seconds'] = round(totals['seconds'] + info['seconds'], 6)
+        for key in ('rows', 'bytes'):
+            if key in info:
+                totals[key] = totals.get(key, 0) + int(info[key])
+    return summary
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    with _metrics_lock:
+        histograms = {key: [entry[0], list(entry[1]), entry[2], entry[3]] for key, entry in _histograms.items()}
+        counters = dict(_counters)
+    with _result_cache_lock:
+        cache = dict(_result_cache_state, entries=len(_result_cache))
+
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+
+    lines += [
+        '# HELP asset_tracker_result_cache_lookups_total Result cache lookups by outcome.',
+        '# TYPE asset_tracker_result_cache_lookups_total counter',
+        f'asset_tracker_result_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+        f'asset_tracker_result_cache_lookups_total{{result="miss"}} {cache["misses"]}',
+        '# HELP asset_tracker_result_cache_bytes Bytes held by the result cache.',
+        '# TYPE asset_tracker_result_cache_bytes gauge',
+        f'asset_tracker_result_cache_bytes {cache["bytes"]}',
+        '# HELP asset_tracker_import_queue_depth Imports waiting for the import worker.',
+        '# TYPE asset_tracker_import_queue_depth gauge',
+        f'asset_tracker_import_queue_depth {_import_queue.qsize()}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+# Telemetry is stored compactly: device and event names live once in lookup
+# tables, and gps_data is clustered on its dedupe key (device_id, ts, sl_no),
+# which also serves device/date-range reads, so no separate index is needed.
+GPS_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS devices (id INTEGER PRIMARY KEY, device TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, event TEXT NOT NULL UNIQUE)',
+    '''
+    CREATE TABLE IF NOT EXISTS gps_data (
+        device_id INTEGER NOT NULL REFERENCES devices(id),
+        ts INTEGER NOT NULL,
+        sl_no INTEGER NOT NULL,
+        event_id INTEGER REFERENCES events(id),
+        battery_voltage REAL,
+        PRIMARY KEY (device_id, ts, sl_no)
+    ) WITHOUT ROWID
+    ''',
+    # gps_data with names resolved, for reads by device name
+    '''
+    CREATE VIEW IF NOT EXISTS gps_readings AS
+    SELECT d.device, g.ts, g.sl_no, e.event, g.battery_voltage
+    FROM gps_data g
+    JOIN devices d ON d.id = g.device_id
+    LEFT JOIN events e ON e.id = g.event_id
+    ''',
+)
+
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
+    """Create gps_data if needed. History is kept across uploads; rows are
+    deduplicated on (device, ts, sl_no), where ts is the tracking date in
+    epoch seconds. Runs once per deploy (flask init-db), not per request:
+    migrating an old database or backfilling a new derived table reads the
+    whole history."""
+    with get_db() as conn:
         c = conn.cursor()
-        c.execute('DROP TABLE IF EXISTS gps_data')
+        columns = [row[1] for row in c.execute('PRAGMA table_info(gps_data)')]
+        if 'tracking_date' in columns:
+            migrate_gps_data(c, ts_sql="CAST(strftime('%s', tracking_date) AS INTEGER)")
+        elif 'device' in columns:
+            migrate_gps_data(c)
+        for statement in GPS_SCHEMA:
+            c.execute(statement)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                status TEXT,
+                rows_read INTEGER DEFAULT 0,
+                rows_inserted INTEGER DEFAULT 0,
+                rows_rejected INTEGER DEFAULT 0,
+                chunks INTEGER DEFAULT 0,
+                started_at TEXT,
+                finished_at TEXT,
+                error TEXT
+            )
+        ''')
+        job_columns = {row[1] for row in c.execute('PRAGMA table_info(import_jobs)')}
+        for column, decl in (('date_format', 'TEXT'),
+                             ('dates_fast', 'INTEGER DEFAULT 0'),
+                             ('dates_fallback', 'INTEGER DEFAULT 0'),
+                             ('worker_pid', 'INTEGER'),
+                             ('rows_archived', 'INTEGER DEFAULT 0')):
+            if column not in job_columns:
+                c.execute(f'ALTER TABLE import_jobs ADD COLUMN {column} {decl}')
+        # Counter bumped by every import; cached results are keyed on it
+        c.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        c.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
+        backfill_charges = not table_exists(c, 'charge_events')
         c.execute('''
-            CREATE TABLE gps_data (
-                sl_no INTEGER,
+            CREATE TABLE IF NOT EXISTS charge_events (
                 device TEXT,
-                event TEXT,
-                tracking_date TEXT,
-                battery_voltage REAL,
-                FOREIGN KEY (device) REFERENCES device_info(device)
+                start_ts INTEGER,
+                end_ts INTEGER,
+                start_voltage REAL,
+                max_voltage REAL,
+                PRIMARY KEY (device, start_ts)
             )
         ''')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_device ON gps_data(device)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_date ON gps_data(tracking_date)')
+        if backfill_charges:
+            backfill_charge_events(conn)
+
+        backfill_daily = not table_exists(c, 'daily_device_stats')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS daily_device_stats (
+                device TEXT,
+                day INTEGER,
+                pings INTEGER,
+                reboots INTEGER,
+                samples INTEGER,
+                min_voltage REAL,
+                max_voltage REAL,
+                avg_voltage REAL,
+                PRIMARY KEY (device, day)
+            )
+        ''')
+        if backfill_daily:
+            backfill_daily_stats(conn)
+        # Parquet files of archived gps_data months; a file is only read once it is listed here
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS archive_files (
+                path TEXT PRIMARY KEY,
+                month INTEGER,
+                bucket INTEGER,
+                rows INTEGER,
+                min_ts INTEGER,
+                max_ts INTEGER
+            )
+        ''')
+        # Gaps between consecutive readings of at least OFFLINE_GAP_MINUTES, and each device's latest reading
+        backfill_offline = not table_exists(c, 'offline_periods')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS offline_periods (
+                device TEXT,
+                start_ts INTEGER,
+                end_ts INTEGER,
+                duration INTEGER,
+                PRIMARY KEY (device, start_ts)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_offline_duration ON offline_periods(duration)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS device_status (
+                device TEXT PRIMARY KEY,
+                first_ts INTEGER,
+                last_ts INTEGER,
+                last_voltage REAL
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_device_status_last_ts ON device_status(last_ts)')
+        if backfill_offline:
+            backfill_offline_periods(conn)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS charge_summary (
+                device TEXT,
+                period_start INTEGER,
+                period_end INTEGER,
+                charges INTEGER,
+                long_offline INTEGER,
+                samples INTEGER,
+                computed_at TEXT,
+                PRIMARY KEY (device, period_start, period_end)
+            )
+        ''')
+
+def table_exists(c, name):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return c.fetchone() is not None
+
+def migrate_gps_data(c, ts_sql='ts'):
+    """Rewrite a gps_data table that stores device and event names on every row
+    into the compact schema. `ts_sql` converts its time column to epoch seconds."""
+    c.execute('BEGIN')
+    c.execute('DROP VIEW IF EXISTS gps_readings')
+    c.execute('ALTER TABLE gps_data RENAME TO gps_data_old')
+    for index in ('idx_gps_unique', 'idx_device', 'idx_date', 'idx_device_ts'):
+        c.execute(f'DROP INDEX IF EXISTS {index}')
+    for statement in GPS_SCHEMA:
+        c.execute(statement)
+    c.execute('INSERT OR IGNORE INTO devices (device) SELECT DISTINCT device FROM gps_data_old WHERE device IS NOT NULL')
+    c.execute('INSERT OR IGNORE INTO events (event) SELECT DISTINCT event FROM gps_data_old WHERE event IS NOT NULL')
+    c.execute(f'''
+        INSERT OR IGNORE INTO gps_data (device_id, ts, sl_no, event_id, battery_voltage)
+        SELECT d.id, {ts_sql}, COALESCE(o.sl_no, 0), e.id, o.battery_voltage
+        FROM gps_data_old o
+        JOIN devices d ON d.device = o.device
+        LEFT JOIN events e ON e.event = o.event
+        WHERE {ts_sql} IS NOT NULL
+    ''')
+    c.execute('DROP TABLE gps_data_old')
+
+def to_epoch(dates):
+    """Naive datetimes (scalar or Series) to integer epoch seconds."""
+    return (dates - EPOCH) // pd.Timedelta(seconds=1)
+
+def from_epoch(seconds):
+    return pd.to_datetime(seconds, unit='s')
+
+def date_range_bounds(from_date, to_date):
+    """Half-open [start, end) epoch bounds covering both dates in full."""
+    return to_epoch(from_date.normalize()), to_epoch(to_date.normalize() + pd.Timedelta(days=1))
 
 def init_device_info_table():
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_db() as conn:
         c = conn.cursor()
+        # Imports used to replace the table through to_sql, dropping its key and indexes
+        if table_exists(c, 'device_info') and not any(row[5] for row in c.execute('PRAGMA table_info(device_info)')):
+            c.execute('ALTER TABLE device_info RENAME TO device_info_unkeyed')
         c.execute('''
             CREATE TABLE IF NOT EXISTS device_info (
                 device TEXT PRIMARY KEY,
@@ -664,479 +1522,2022 @@ def init_device_info_table():
                 sim_type TEXT
             )
         ''')
+        if table_exists(c, 'device_info_unkeyed'):
+            # Later rows won, as they would have in a single upload
+            c.execute('''
+                INSERT OR REPLACE INTO device_info (device, region, branch, sim_type)
+                SELECT device, region, branch, sim_type FROM device_info_unkeyed
+                WHERE device IS NOT NULL ORDER BY rowid
+            ''')
+            c.execute('DROP TABLE device_info_unkeyed')
         c.execute('CREATE INDEX IF NOT EXISTS idx_region ON device_info(region)')
         c.execute('CREATE INDEX IF NOT EXISTS idx_branch ON device_info(branch)')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() == 'csv'
 
-def import_device_info(file_path):
-    df = pd.read_csv(file_path)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+def classify_upload(head):
+    """(kind, encoding, delimiter, header) of an upload from its first bytes,
+    where kind is 'telemetry' or 'device_info' and header lists the column
+    names as written. Raises ValueError for a file that is neither."""
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                          (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            break
+    else:
+        encoding = 'utf-8'
+        try:
+            # Incremental, so a character cut off at the end of the head is not an error
+            codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError:  # spreadsheet exports on Windows
+            encoding = 'cp1252'
+    lines = codecs.getincrementaldecoder(encoding)(errors='replace').decode(head).splitlines()
+    if len(head) == UPLOAD_SNIFF_BYTES:
+        lines = lines[:-1]  # may be cut short
+    if not lines or not lines[0].strip():
+        raise ValueError("The file is empty or its first line is blank")
 
-    required = ['device_id', 'region', 'branch', 'sim_type']
-    missing = [col for col in required if col not in df.columns]
-    if missing:
-        raise ValueError(f"Missing required columns in metadata: {missing}")
+    try:
+        delimiter = csv.Sniffer().sniff('\n'.join(lines[:20]), delimiters=UPLOAD_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+    header = next(csv.reader([lines[0]], delimiter=delimiter))
+    names = list(normalize_columns(pd.Index(header)))
+
+    telemetry = [GPS_COLUMN_MAPPING.get(name, name) for name in names]
+    if all(col in telemetry for col in GPS_REQUIRED_COLUMNS):
+        return 'telemetry', encoding, delimiter, header
+    if 'device_id' in names:
+        return 'device_info', encoding, delimiter, header
+    missing = [col for col in GPS_REQUIRED_COLUMNS if col not in telemetry]
+    raise ValueError(f"Not a telemetry file (missing columns: {missing}) "
+                     f"or device metadata (missing column: device_id)")
+
+def save_upload(file, kinds=('telemetry', 'device_info')):
+    """Classify an uploaded file from its head, then save it to UPLOAD_FOLDER.
+
+    Returns (path, kind, read_options), where read_options are the encoding,
+    delimiter and header keywords for the importer, so it does not have to
+    read the header again. A file that cannot be imported, or is not one of
+    `kinds`, is rejected before the rest of it is read.
+    """
+    head = file.stream.read(UPLOAD_SNIFF_BYTES)
+    kind, encoding, delimiter, header = classify_upload(head)
+    if kind not in kinds:
+        raise ValueError(f"Expected {' or '.join(UPLOAD_KINDS[k] for k in kinds)}, got {UPLOAD_KINDS[kind]}")
+    path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}.csv"))
+    with open(path, 'wb') as out:
+        out.write(head)
+        shutil.copyfileobj(file.stream, out)
+    return path, kind, {'encoding': encoding, 'delimiter': delimiter, 'header': header}
+
+def read_csv_header(file_path, header, encoding, delimiter):
+    """Column names of a CSV: `header` when the upload already parsed it, else its first row.
+    Repeated names get .1, .2 suffixes, as read_csv gives them."""
+    if header is None:
+        return pd.read_csv(file_path, nrows=0, sep=delimiter, encoding=encoding).columns
+    names = []
+    for name in header:
+        unique, n = name, 0
+        while unique in names:
+            n += 1
+            unique = f'{name}.{n}'
+        names.append(unique)
+    return pd.Index(names)
+
+def import_device_info(file_path, import_id=None, chunksize=CSV_CHUNK_ROWS, encoding='utf-8',
+                       delimiter=',', header=None):
+    """Upsert a device metadata CSV into device_info `chunksize` rows at a time.
+
+    Only device_id is required. Devices missing from the file, columns
+    missing from it and blank cells keep their stored values, so a partial
+    file updates just what it lists. Each chunk is one transaction.
+    """
+    header = read_csv_header(file_path, header, encoding, delimiter)
+    names = list(normalize_columns(header))
+    if 'device_id' not in names:
+        raise ValueError("Missing required columns in metadata: ['device_id']")
+    rename = {orig: DEVICE_INFO_COLUMN_MAPPING.get(name, name) for orig, name in zip(header, names)
+              if name == 'device_id' or name in DEVICE_INFO_COLUMNS}
+    columns = [name for name in DEVICE_INFO_COLUMNS if name in rename.values()]
+    upsert = f'''
+        INSERT INTO device_info (device{''.join(f', {col}' for col in columns)})
+        VALUES (?{', ?' * len(columns)})
+        ON CONFLICT(device) DO {'UPDATE SET ' + ', '.join(f'{col} = COALESCE(excluded.{col}, {col})'
+                                                          for col in columns) if columns else 'NOTHING'}
+    '''
+
+    import_id = import_id or str(uuid.uuid4())
+    stats = {'rows': 0, 'inserted': 0, 'rejected': 0, 'chunks': 0}
+    trace = []
+    started = time.perf_counter()
+    with get_db() as conn:
+        start_import_job(conn, import_id, os.path.basename(file_path))
+        try:
+            reader = pd.read_csv(file_path, header=0, names=header, index_col=False, usecols=list(rename),
+                                 dtype=str, chunksize=chunksize, sep=delimiter, encoding=encoding)
+            for chunk in reader:
+                rows = len(chunk)
+                with stage('device_info.parse', trace) as timing:
+                    chunk = chunk.rename(columns=rename)[['device', *columns]]
+                    chunk = chunk.apply(lambda values: values.str.strip())
+                    chunk = chunk.where(chunk != '')
+                    chunk = chunk.dropna(subset=['device'])
+                    timing['rows'] = rows
+
+                with conn, stage('device_info.write', trace) as timing:
+                    conn.executemany(upsert, chunk.astype(object).where(chunk.notna(), None)
+                                     .itertuples(index=False, name=None))
+                    bump_data_version(conn)
+                    stats['rows'] += rows
+                    stats['inserted'] += len(chunk)
+                    stats['rejected'] += rows - len(chunk)
+                    stats['chunks'] += 1
+                    update_import_job(conn, import_id, stats)
+                    timing['rows'] = len(chunk)
+        except Exception as e:
+            finish_import_job(conn, import_id, 'failed', error=str(e))
+            record_import(import_id, 'device_info', 'failed', time.perf_counter() - started, stats, trace)
+            raise
+        finish_import_job(conn, import_id, 'done')
+    record_import(import_id, 'device_info', 'done', time.perf_counter() - started, stats, trace)
+    return stats
+
+def normalize_columns(columns):
+    return columns.str.strip().str.lower().str.replace(' ', '_')
+
+def sniff_date_format(dates, date_format='mmddyyyy', sample_size=DATE_SAMPLE_ROWS):
+    """Return the explicit strptime format that parses most of a sample of
+    tracking dates, or None if none of the known layouts fit any of them.
+    `date_format` is the order picked on the upload form and breaks ties."""
+    dates = dates.dropna()
+    step = max(len(dates) // sample_size, 1)
+    sample = dates.iloc[::step].head(sample_size)
+
+    if date_format == 'ddmmyyyy':
+        candidates = DAY_FIRST_FORMATS + MONTH_FIRST_FORMATS + ISO_FORMATS
+    else:
+        candidates = MONTH_FIRST_FORMATS + DAY_FIRST_FORMATS + ISO_FORMATS
+
+    best, best_hits = None, 0
+    for fmt in candidates:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+            if hits == len(sample):
+                break
+    return best
+
+def parse_tracking_dates(dates, fmt, date_format='mmddyyyy'):
+    """Parse `dates` with the explicit format `fmt`, sending only the rows it
+    does not match through per-row format inference.
+
+    Returns (parsed, fast, fallback): the datetimes (NaT where neither path
+    could parse) and how many rows each path parsed.
+    """
+    if fmt:
+        parsed = pd.to_datetime(dates, format=fmt, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    missed = parsed.isna()
+    fast = len(dates) - int(missed.sum())
+
+    fallback = 0
+    if missed.any():
+        # ISO dates first so dayfirst cannot swap their month and day
+        retry = pd.to_datetime(dates[missed], format='ISO8601', errors='coerce')
+        unparsed = retry.isna()
+        if unparsed.any():
+            retry[unparsed] = pd.to_datetime(dates[missed][unparsed], format='mixed',
+                                             dayfirst=(date_format == 'ddmmyyyy'), errors='coerce')
+        parsed[missed] = retry
+        fallback = int(retry.notna().sum())
+    return parsed, fast, fallback
+
+def parse_gps_chunk(df, fmt, date_format='mmddyyyy'):
+    """Normalize one chunk of raw telemetry and drop rows that cannot be stored.
+
+    Returns the chunk and the number of tracking dates parsed by the explicit
+    `fmt` and by the fallback (see parse_tracking_dates).
+    """
+    # Normalize text
+    df['event'] = df['event'].astype(str).str.strip().str.upper().astype('category')
+    df['device'] = df['device'].astype(str).str.strip().astype('category')
+    df['tracking_date'] = df['tracking_date'].str.strip()
 
-    df = df[required]
-    df.rename(columns={'device_id': 'device'}, inplace=True)
-    df.dropna(subset=['device'], inplace=True)
+    df['tracking_date'], fast, fallback = parse_tracking_dates(df['tracking_date'], fmt, date_format)
 
-    with sqlite3.connect(DB_NAME) as conn:
-        df.to_sql('device_info', conn, if_exists='replace', index=False)
+    # Ensure battery voltage is numeric
+    df['battery_voltage'] = pd.to_numeric(df['battery_voltage'], errors='coerce')
+    df.dropna(subset=['tracking_date', 'battery_voltage', 'device'], inplace=True)
+    # Rows without a serial number are deduplicated on device and time alone
+    df['sl_no'] = pd.to_numeric(df['sl_no'], errors='coerce').fillna(0).astype(np.int64)
+    for column in ('device', 'event'):
+        df[column] = df[column].cat.remove_unused_categories()
+
+    df['ts'] = to_epoch(df.pop('tracking_date'))
+    return df, fast, fallback
+
+def import_csv(file_path, date_format='mmddyyyy', import_id=None, chunksize=CSV_CHUNK_ROWS,
+               encoding='utf-8', delimiter=',', header=None):
+    """Stream a telemetry CSV into gps_data `chunksize` rows at a time.
+
+    Each chunk is parsed and written in its own transaction, so memory stays
+    bounded by the chunk size rather than the file size. Progress is recorded
+    in import_jobs under `import_id` after every chunk.
+    """
+    header = read_csv_header(file_path, header, encoding, delimiter)
+    names = [GPS_COLUMN_MAPPING.get(c, c) for c in normalize_columns(header)]
+
+    missing = [col for col in GPS_REQUIRED_COLUMNS if col not in names]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
 
-def import_csv(file_path, date_format='mmddyyyy'):
-    df = pd.read_csv(file_path, low_memory=False)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    # Only read the columns we store, and keep the text ones as strings
+    rename = {orig: name for orig, name in zip(header, names) if name in GPS_REQUIRED_COLUMNS}
+    text_columns = {orig: str for orig, name in rename.items() if name in ('device', 'event', 'tracking_date')}
 
-    column_mapping = {'sl._no': 'sl_no', 'event_type': 'event'}
-    df.rename(columns=column_mapping, inplace=True)
+    import_id = import_id or str(uuid.uuid4())
+    stats = {'rows': 0, 'inserted': 0, 'rejected': 0, 'archived': 0, 'chunks': 0,
+             'date_format': None, 'dates_fast': 0, 'dates_fallback': 0}
+    trace = []
+    started = time.perf_counter()
 
-    required = ['sl_no', 'device', 'event', 'tracking_date', 'battery_voltage']
-    missing = [col for col in required if col not in df.columns]
-    if missing:
-        raise ValueError(f"Missing required columns: {missing}")
+    with get_db() as conn:
+        start_import_job(conn, import_id, os.path.basename(file_path))
+        try:
+            reader = pd.read_csv(file_path, header=0, names=header, index_col=False, usecols=list(rename),
+                                 dtype=text_columns, chunksize=chunksize, sep=delimiter, encoding=encoding)
+            for chunk in reader:
+                rows = len(chunk)
+                chunk = chunk.rename(columns=rename)[GPS_REQUIRED_COLUMNS]
+                with stage('import.parse', trace) as timing:
+                    if stats['chunks'] == 0:
+                        # One format per upload, sniffed from the first chunk
+                        stats['date_format'] = sniff_date_format(chunk['tracking_date'].str.strip(), date_format)
+                    df, fast, fallback = parse_gps_chunk(chunk, stats['date_format'], date_format)
+                    timing['rows'] = rows
+
+                with conn:
+                    with stage('import.insert', trace) as timing:
+                        inserted, archived, new_ranges = insert_gps_rows(conn, df)
+                        timing['rows'] = len(df)
+                    with stage('import.derived_tables', trace) as timing:
+                        refresh_derived_tables(conn, new_ranges)
+                        timing['rows'] = inserted
+                    stats['inserted'] += inserted
+                    stats['archived'] += archived
+                    stats['rows'] += rows
+                    stats['rejected'] += rows - len(df)
+                    stats['chunks'] += 1
+                    stats['dates_fast'] += fast
+                    stats['dates_fallback'] += fallback
+                    update_import_job(conn, import_id, stats)
+        except Exception as e:
+            finish_import_job(conn, import_id, 'failed', error=str(e))
+            record_import(import_id, 'telemetry', 'failed', time.perf_counter() - started, stats, trace)
+            raise
+        finish_import_job(conn, import_id, 'done')
+
+    stats['duplicates'] = stats['rows'] - stats['rejected'] - stats['inserted'] - stats['archived']
+    record_import(import_id, 'telemetry', 'done', time.perf_counter() - started, stats, trace)
+    return stats
+
+def record_import(import_id, kind, status, seconds, stats, trace):
+    """Feed a finished import into the metrics and log it if it was slow."""
+    observe('asset_tracker_import_seconds', seconds, IMPORT_BUCKETS, kind=kind, status=status)
+    for outcome in ('rows', 'inserted', 'rejected', 'archived'):
+        increment('asset_tracker_import_rows_total', stats.get(outcome, 0), kind=kind, outcome=outcome)
+    if seconds >= app.config['SLOW_IMPORT_SECONDS']:
+        app.logger.warning('slow import %s', json.dumps({
+            'event': 'slow_import',
+            'import_id': import_id,
+            'kind': kind,
+            'status': status,
+            'seconds': round(seconds, 3),
+            'rows': stats.get('rows', 0),
+            'inserted': stats.get('inserted', 0),
+            'rejected': stats.get('rejected', 0),
+            'archived': stats.get('archived', 0),
+            'stages': summarize_stages(trace),
+        }))
+
+def start_import_job(conn, import_id, filename):
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO import_jobs (id, filename, status, started_at, worker_pid)
+            VALUES (?, ?, 'running', ?, ?)
+        ''', (import_id, filename, datetime.now().isoformat(timespec='milliseconds'), os.getpid()))
+
+def update_import_job(conn, import_id, stats):
+    conn.execute('''
+        UPDATE import_jobs
+        SET rows_read = ?, rows_inserted = ?, rows_rejected = ?, rows_archived = ?, chunks = ?,
+            date_format = ?, dates_fast = ?, dates_fallback = ?
+        WHERE id = ?
+    ''', (stats['rows'], stats['inserted'], stats['rejected'], stats.get('archived', 0), stats['chunks'],
+          stats.get('date_format'), stats.get('dates_fast', 0), stats.get('dates_fallback', 0), import_id))
+
+def finish_import_job(conn, import_id, status, error=None):
+    with conn:
+        conn.execute(
+            'UPDATE import_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+            (status, error, datetime.now().isoformat(timespec='milliseconds'), import_id)
+        )
 
-    df = df[required]
+_import_queue = queue.Queue()
+_import_worker = {'pid': None}
+_import_worker_lock = threading.Lock()
+
+def submit_import(importer, file_path, **kwargs):
+    """Queue `importer(file_path, import_id=..., **kwargs)` on this process's
+    background import thread and return the job id to poll at /jobs/<id>."""
+    job_id = str(uuid.uuid4())
+    with _import_worker_lock:
+        # A forked gunicorn worker does not inherit the parent's thread
+        if _import_worker['pid'] != os.getpid():
+            with get_db() as conn:
+                fail_orphaned_import_jobs(conn)
+            threading.Thread(target=run_import_jobs, name='import-worker', daemon=True).start()
+            _import_worker['pid'] = os.getpid()
+        with get_db() as conn:
+            conn.execute(
+                "INSERT INTO import_jobs (id, filename, status, worker_pid) VALUES (?, ?, 'queued', ?)",
+                (job_id, os.path.basename(file_path), os.getpid())
+            )
+    _import_queue.put((job_id, importer, file_path, kwargs))
+    return job_id
 
-    # Normalize text
-    df['event'] = df['event'].astype(str).str.strip().str.upper()
-    df['device'] = df['device'].astype(str).str.strip()
+ORPHANED_JOB_ERROR = 'The worker running this import stopped'
 
-    # Clean and convert tracking_date based on selected format
-    df['tracking_date'] = df['tracking_date'].astype(str).str.strip()
-   
-    # First try parsing with the specified format
+def import_worker_alive(pid):
+    """Whether the process that queued or started an import job can still finish it."""
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return _import_worker['pid'] == pid  # only while this process's import thread runs
     try:
-        if date_format == 'ddmmyyyy':
-            df['tracking_date'] = pd.to_datetime(df['tracking_date'], dayfirst=True, errors='raise')
-        else:  # default to mm/dd/yyyy
-            df['tracking_date'] = pd.to_datetime(df['tracking_date'], format='%m/%d/%Y %I:%M:%S %p', errors='raise')
-    except:
-        # If format parsing fails, try more flexible parsing
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fail_orphaned_import_jobs(conn):
+    """Mark queued or running jobs as failed when the process that owned
+    them is gone (a recycled or restarted worker), and delete their uploads."""
+    pending = conn.execute(
+        "SELECT id, filename, worker_pid FROM import_jobs WHERE status IN ('queued', 'running')"
+    ).fetchall()
+    orphaned = [(job_id, filename) for job_id, filename, pid in pending if not import_worker_alive(pid)]
+    if orphaned:
+        conn.executemany(
+            "UPDATE import_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            [(ORPHANED_JOB_ERROR, datetime.now().isoformat(timespec='milliseconds'), job_id)
+             for job_id, _ in orphaned]
+        )
+        for _, filename in orphaned:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], filename or '')
+            if filename and os.path.exists(path):
+                os.remove(path)
+        app.logger.warning(f"Marked {len(orphaned)} orphaned import job(s) as failed")
+
+def run_import_jobs():
+    while True:
+        job_id, importer, file_path, kwargs = _import_queue.get()
         try:
-            df['tracking_date'] = pd.to_datetime(df['tracking_date'], errors='coerce')
-        except:
-            raise ValueError("Could not parse dates with either specified format or flexible parsing")
-
-    # Ensure battery voltage is numeric
-    df['battery_voltage'] = pd.to_numeric(df['battery_voltage'], errors='coerce')
-    df.dropna(subset=['tracking_date', 'battery_voltage', 'device'], inplace=True)
+            importer(file_path, import_id=job_id, **kwargs)
+        except Exception as e:
+            app.logger.exception(f"Import job {job_id} failed")
+            with get_db() as conn:
+                finish_import_job(conn, job_id, 'failed', error=str(e))
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            _import_queue.task_done()
+
+def lookup_ids(conn, table, column, names):
+    """Ids of `names` in a lookup table such as devices or events, adding any new names."""
+    conn.executemany(f'INSERT OR IGNORE INTO {table} ({column}) VALUES (?)', ((name,) for name in names))
+    ids = {}
+    for i in range(0, len(names), 500):
+        batch = list(names[i:i + 500])
+        ids.update(conn.execute(
+            f'SELECT {column}, id FROM {table} WHERE {column} IN ({", ".join("?" * len(batch))})', batch
+        ))
+    return np.array([ids[name] for name in names], dtype=np.int64)
+
+def insert_gps_rows(conn, df):
+    """Append rows to gps_data, skipping any already stored.
+
+    `device` and `event` are categoricals (see parse_gps_chunk); each category
+    is resolved to its lookup id once rather than per row.
+
+    Returns the number of new rows, the number refused because they fall in
+    archived months and, for each device that gained rows, the (first, last)
+    ts of its new rows, which is where its derived tables need recomputing.
+    """
+    device_ids = lookup_ids(conn, 'devices', 'device', df['device'].cat.categories)
+    event_ids = lookup_ids(conn, 'events', 'event', df['event'].cat.categories)
+    rows = pd.DataFrame({
+        'device_id': device_ids[df['device'].cat.codes.to_numpy()],
+        'ts': df['ts'].to_numpy(),
+        'sl_no': df['sl_no'].to_numpy(),
+        'event_id': event_ids[df['event'].cat.codes.to_numpy()],
+        'battery_voltage': df['battery_voltage'].to_numpy(),
+    })
+
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS gps_staging (
+            device_id INTEGER,
+            ts INTEGER,
+            sl_no INTEGER,
+            event_id INTEGER,
+            battery_voltage REAL
+        )
+    ''')
+    conn.execute('DELETE FROM gps_staging')
+    conn.executemany(
+        'INSERT INTO gps_staging (device_id, ts, sl_no, event_id, battery_voltage) VALUES (?, ?, ?, ?, ?)',
+        rows.itertuples(index=False, name=None)
+    )
+    # Archived months are immutable; rows for them are counted, not stored
+    archived = conn.execute('''
+        DELETE FROM gps_staging
+        WHERE ts < (SELECT MAX(value) FROM meta WHERE key IN ('archived_before', 'archiving_before'))
+    ''').rowcount
+    new_ranges = {device: (first, last) for device, first, last in conn.execute('''
+        SELECT d.device, MIN(s.ts), MAX(s.ts) FROM gps_staging s
+        JOIN devices d ON d.id = s.device_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM gps_data g
+            WHERE g.device_id = s.device_id AND g.ts = s.ts AND g.sl_no = s.sl_no
+        )
+        GROUP BY s.device_id
+    ''')}
+    cur = conn.execute('''
+        INSERT OR IGNORE INTO gps_data (device_id, ts, sl_no, event_id, battery_voltage)
+        SELECT device_id, ts, sl_no, event_id, battery_voltage FROM gps_staging
+    ''')
+    conn.execute('DELETE FROM gps_staging')
+    return cur.rowcount, archived, new_ranges
+
+def find_charge_cycles(times, voltages, rise_threshold=0.15, window=3, merge_gap=CHARGE_MERGE_GAP):
+    """Locate charge cycles in a time-sorted voltage series.
+
+    A rise starts at sample i when voltages[i + window] - voltages[i] >= rise_threshold;
+    the scan then resumes from the highest sample in that window. Rises whose start
+    is within `merge_gap` of the previous rise's peak are merged into one cycle.
+
+    Returns arrays (start_index, peak_index, start_voltage, max_voltage), one entry per cycle.
+    """
+    voltages = np.asarray(voltages, dtype=float)
+    times = np.asarray(times)
+    empty = np.array([], dtype=np.intp)
+    if len(voltages) <= window:
+        return empty, empty, np.array([]), np.array([])
+
+    windows = sliding_window_view(voltages, window + 1)
+    with np.errstate(invalid='ignore'):
+        rises = np.flatnonzero(windows[:, -1] - windows[:, 0] >= rise_threshold)
+    if len(rises) == 0:
+        return empty, empty, np.array([]), np.array([])
+    # First maximum in each rising window, ignoring missing readings
+    peaks = rises + np.nan_to_num(windows[rises], nan=-np.inf).argmax(axis=1)
+
+    # Each detected rise resumes the scan at its peak, so only rises at or after
+    # the previous peak count
+    chosen = []
+    k = 0
+    while k < len(rises):
+        chosen.append(k)
+        k = np.searchsorted(rises, peaks[k], side='left')
+    starts = rises[chosen]
+    ends = peaks[chosen]
+
+    gaps = times[starts[1:]] - times[ends[:-1]]
+    first = np.flatnonzero(np.concatenate(([True], gaps > merge_gap)))
+    return (
+        starts[first],
+        np.maximum.reduceat(ends, first),
+        np.minimum.reduceat(voltages[starts], first),
+        np.maximum.reduceat(voltages[ends], first),
+    )
 
-    with sqlite3.connect(DB_NAME) as conn:
-        df.to_sql('gps_data', conn, if_exists='append', index=False)
-       
-def detect_charges(df, rise_threshold=0.15, window=3):
-    df = df.sort_values('tracking_date').reset_index(drop=True)
-    voltages = df['battery_voltage'].tolist()
-    timestamps = df['tracking_date'].tolist()
-    raw_charges = []
-    i = 0
-
-    while i < len(voltages) - window:
-        start_voltage = voltages[i]
-        end_voltage = voltages[i + window]
-
-        if pd.notna(start_voltage) and pd.notna(end_voltage) and end_voltage - start_voltage >= rise_threshold:
-            max_voltage = max(voltages[i:i+window+1])
-            max_index = i + voltages[i:i+window+1].index(max_voltage)
-
-            start_time = timestamps[i]
-            end_time = timestamps[max_index]
-            charge_duration = end_time - start_time
-            days_offline = charge_duration.total_seconds() / (24 * 3600)
-
-            raw_charges.append({
-                'start_time_dt': start_time,
-                'end_time_dt': end_time,
-                'date': start_time.date(),
-                'start_voltage': start_voltage,
-                'max_voltage': max_voltage,
-                'duration': charge_duration,
-                'days_offline': days_offline,
-                'is_long_offline': days_offline >= 2
-            })
+def format_charge(start_time, end_time, start_voltage, max_voltage):
+    """Build the charge dict shown in the results table and chart."""
+    charge_duration = end_time - start_time
+    days_offline = charge_duration.total_seconds() / (24 * 3600)
+    charge = {
+        'start_time_dt': start_time,
+        'end_time_dt': end_time,
+        'date': start_time.strftime('%d-%m-%Y'),
+        'start_voltage': float(start_voltage),
+        'max_voltage': float(max_voltage),
+        'start_time': start_time.strftime('%I:%M:%S %p'),
+        'end_time': end_time.strftime('%I:%M:%S %p'),
+        'days_offline': days_offline,
+        'is_long_offline': days_offline >= LONG_OFFLINE_DAYS
+    }
 
-            i = max_index
-        else:
-            i += 1
+    charge['duration'] = format_duration(charge_duration.total_seconds())
 
-    # Merge nearby events (<30 mins apart)
-    merged_charges = []
-    for charge in raw_charges:
-        if not merged_charges:
-            merged_charges.append(charge)
-            continue
+    if charge['is_long_offline']:
+        charge['days_offline'] = charge['duration']
 
-        last = merged_charges[-1]
-        if charge['start_time_dt'] - last['end_time_dt'] <= timedelta(minutes=60):
-            # Merge into last
-            last['end_time_dt'] = max(last['end_time_dt'], charge['end_time_dt'])
-            last['max_voltage'] = max(last['max_voltage'], charge['max_voltage'])
-            last['start_voltage'] = min(last['start_voltage'], charge['start_voltage'])
-            last['duration'] = last['end_time_dt'] - last['start_time_dt']
-            last['days_offline'] = last['duration'].total_seconds() / (24 * 3600)
-            last['is_long_offline'] = last['days_offline'] >= 2
-        else:
-            merged_charges.append(charge)
-
-    # Format result for template
-    for charge in merged_charges:
-        charge['start_time'] = charge['start_time_dt'].strftime('%I:%M:%S %p')
-        charge['end_time'] = charge['end_time_dt'].strftime('%I:%M:%S %p')
-        charge['date'] = charge['start_time_dt'].strftime('%d-%m-%Y')
-
-        total_seconds = charge['duration'].total_seconds()
-        days = int(total_seconds // 86400)
-        hours = int((total_seconds % 86400) // 3600)
-        minutes = int((total_seconds % 3600) // 60)
-        charge['duration'] = f"{days} days {hours} hrs {minutes} mins"
-       
-        if charge['is_long_offline']:
-            charge['days_offline'] = f"{days} days {hours} hrs {minutes} mins"
+    return charge
 
-    return merged_charges
+def format_duration(total_seconds):
+    days = int(total_seconds // 86400)
+    hours = int((total_seconds % 86400) // 3600)
+    minutes = int((total_seconds % 3600) // 60)
+    return f"{days} days {hours} hrs {minutes} mins"
 
-def create_combined_chart(ping_series, charge_details, full_voltage_df, title="Activity Summary"):
+def detect_charges(df, rise_threshold=0.15, window=3):
+    df = df.sort_values('tracking_date').reset_index(drop=True)
+    timestamps = df['tracking_date']
+    starts, ends, start_voltages, max_voltages = find_charge_cycles(
+        timestamps.to_numpy(), df['battery_voltage'].to_numpy(dtype=float),
+        rise_threshold=rise_threshold, window=window
+    )
+    return [
+        format_charge(timestamps.iloc[start], timestamps.iloc[end], start_voltage, max_voltage)
+        for start, end, start_voltage, max_voltage in zip(starts, ends, start_voltages, max_voltages)
+    ]
+
+def iter_device_series(conn, start_ts, end_ts, batch_rows=CSV_CHUNK_ROWS):
+    """Yield (device, ts, voltages) for every device with data in [start_ts, end_ts),
+    from a single scan of gps_data read `batch_rows` at a time."""
+    boundary = archived_before(conn)
+    if boundary is not None and start_ts < boundary:
+        yield from iter_archived_device_series(conn, start_ts, end_ts, boundary)
+        return
+
+    # Scanned in primary key order, so each device's rows arrive together
+    names = dict(conn.execute('SELECT id, device FROM devices'))
+    chunks = pd.read_sql_query('''
+        SELECT device_id, ts, battery_voltage FROM gps_data
+        WHERE ts >= ? AND ts < ?
+        ORDER BY device_id, ts
+    ''', conn, params=(start_ts, end_ts), chunksize=batch_rows)
+
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # The last device may continue in the next chunk
+        tail = chunk['device_id'].to_numpy() == chunk['device_id'].iloc[-1]
+        carry = chunk[tail]
+        for device_id, group in chunk[~tail].groupby('device_id', sort=False):
+            yield names[device_id], group['ts'].to_numpy(dtype=np.int64), group['battery_voltage'].to_numpy(dtype=float)
+    if carry is not None and not carry.empty:
+        yield (names[carry['device_id'].iloc[0]], carry['ts'].to_numpy(dtype=np.int64),
+               carry['battery_voltage'].to_numpy(dtype=float))
+
+def iter_archived_device_series(conn, start_ts, end_ts, boundary):
+    """iter_device_series for a range reaching into the archive, one device
+    hash bucket at a time: a bucket's archived rows and its devices' rows
+    still in gps_data are loaded together, so only about 1/ARCHIVE_BUCKETS of
+    the range is in memory at once."""
+    columns = ['device', 'ts', 'battery_voltage']
+    hot_devices = {}
+    if end_ts > boundary:
+        for (device,) in conn.execute('SELECT DISTINCT device FROM gps_readings WHERE ts >= ? AND ts < ?',
+                                      (boundary, end_ts)):
+            hot_devices.setdefault(device_bucket(device), []).append(device)
+
+    for bucket in range(ARCHIVE_BUCKETS):
+        frames = [read_archive(conn, start_ts, min(end_ts, boundary), columns, bucket=bucket)]
+        devices = hot_devices.get(bucket, [])
+        if devices:
+            frames.append(pd.read_sql_query(f'''
+                SELECT device, ts, battery_voltage FROM gps_readings
+                WHERE device IN ({', '.join('?' * len(devices))}) AND ts >= ? AND ts < ?
+            ''', conn, params=(*devices, boundary, end_ts)))
+        df = pd.concat(frames, ignore_index=True).sort_values(['device', 'ts'], kind='stable')
+        for device, group in df.groupby('device', sort=False):
+            yield device, group['ts'].to_numpy(dtype=np.int64), group['battery_voltage'].to_numpy(dtype=float)
+
+def summarize_device_charges(item):
+    """Charge and long-offline counts for one device. Runs in a worker process."""
+    device, ts, voltages = item
+    times = ts.astype('datetime64[s]')
+    starts, ends, _, _ = find_charge_cycles(times, voltages)
+    long_offline = np.count_nonzero(times[ends] - times[starts] >= np.timedelta64(LONG_OFFLINE_DAYS, 'D'))
+    return device, len(starts), int(long_offline), len(ts)
+
+def run_charge_batch(start_ts, end_ts, workers=None):
+    """Summarize charges for every device over [start_ts, end_ts) into charge_summary."""
+    workers = workers or os.cpu_count()
+    results = []
+    with get_db() as conn, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for item in iter_device_series(conn, start_ts, end_ts):
+            pending.add(pool.submit(summarize_device_charges, item))
+            # Bound the number of device series held in memory at once
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in done)
+        results.extend(f.result() for f in pending)
+
+        computed_at = datetime.now().isoformat(timespec='seconds')
+        with conn:
+            conn.execute('DELETE FROM charge_summary WHERE period_start = ? AND period_end = ?', (start_ts, end_ts))
+            conn.executemany('''
+                INSERT INTO charge_summary
+                    (device, period_start, period_end, charges, long_offline, samples, computed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(device, start_ts, end_ts, charges, long_offline, samples, computed_at)
+                  for device, charges, long_offline, samples in results])
+            bump_data_version(conn)
+    return len(results)
+
+def refresh_derived_tables(conn, new_ranges):
+    """Bring tables derived from gps_data up to date after new rows were inserted.
+
+    `new_ranges` maps each device that gained rows to the (first, last) ts of them.
+    """
+    for device, (first_ts, last_ts) in new_ranges.items():
+        update_charge_events(conn, device, first_ts)
+        update_daily_stats(conn, device, first_ts, last_ts)
+        update_offline_periods(conn, device, first_ts, last_ts)
+        update_device_status(conn, device, first_ts)
+    if new_ranges:
+        bump_data_version(conn)
+
+def data_version(conn):
     try:
-        fig = go.Figure()
-
-        # ===== 1. Convert and validate ping_series =====
-        if not isinstance(ping_series, (pd.Series, list)):
-            ping_series = pd.Series(ping_series)
-       
-        ping_series = pd.to_datetime(ping_series, errors='coerce').dropna()
-       
-        if ping_series.empty:
-            app.logger.warning("No valid ping dates found")
-            return None
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    except sqlite3.OperationalError:  # database predates the meta table
+        return 0
+    return row[0] if row else 0
+
+def bump_data_version(conn):
+    """Invalidate cached results in every process; call inside the import's transaction."""
+    conn.execute('''
+        INSERT INTO meta (key, value) VALUES ('data_version', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    ''')
+
+DAILY_STATS_SELECT = '''
+    SELECT device, ts - ts % 86400 AS day,
+           SUM(event = 'G_PING'), SUM(event = 'REBOOT'), COUNT(*),
+           MIN(battery_voltage), MAX(battery_voltage), AVG(battery_voltage)
+    FROM gps_readings
+'''
+
+def update_daily_stats(conn, device, first_ts, last_ts):
+    """Recompute the daily_device_stats rows for the days between two ts."""
+    conn.execute(f'''
+        INSERT OR REPLACE INTO daily_device_stats
+            (device, day, pings, reboots, samples, min_voltage, max_voltage, avg_voltage)
+        {DAILY_STATS_SELECT}
+        WHERE device = ? AND ts >= ? AND ts < ?
+        GROUP BY day
+    ''', (device, first_ts - first_ts % 86400, last_ts - last_ts % 86400 + 86400))
+
+def backfill_daily_stats(conn):
+    conn.execute(f'''
+        INSERT OR REPLACE INTO daily_device_stats
+            (device, day, pings, reboots, samples, min_voltage, max_voltage, avg_voltage)
+        {DAILY_STATS_SELECT}
+        GROUP BY device, day
+    ''')
+
+def store_charge_events(conn, device, ts, voltages):
+    times = ts.astype('datetime64[s]')
+    starts, ends, start_voltages, max_voltages = find_charge_cycles(times, voltages)
+    conn.executemany('''
+        INSERT OR REPLACE INTO charge_events (device, start_ts, end_ts, start_voltage, max_voltage)
+        VALUES (?, ?, ?, ?, ?)
+    ''', zip([device] * len(starts), ts[starts].tolist(), ts[ends].tolist(),
+             start_voltages.tolist(), max_voltages.tolist()))
+
+def update_charge_events(conn, device, since_ts, window=3):
+    """Recompute the charge cycles of `device` that rows from `since_ts` on can affect.
+
+    A rise starting `window` samples before the first new row never sees it, so
+    every stored cycle that ends before that sample is final. Detection restarts
+    at the start of the last such cycle, which also redoes the 60 minute merge
+    with whatever follows it.
+    """
+    guard = conn.execute('''
+        SELECT ts FROM gps_readings WHERE device = ? AND ts < ?
+        ORDER BY ts DESC LIMIT 1 OFFSET ?
+    ''', (device, since_ts, window - 1)).fetchone()
+    if guard is None and archived_before(conn) is not None:
+        # The guard sample may already be archived
+        earlier = read_device_rows(conn, device, np.iinfo(np.int64).min, since_ts, ['ts'])['ts']
+        guard = (int(earlier.iloc[-window]),) if len(earlier) >= window else None
+    restart = None
+    if guard is not None:
+        restart = conn.execute('''
+            SELECT MAX(start_ts) FROM charge_events WHERE device = ? AND end_ts < ?
+        ''', (device, guard[0])).fetchone()[0]
+    if restart is None:
+        restart = np.iinfo(np.int64).min
+
+    conn.execute('DELETE FROM charge_events WHERE device = ? AND start_ts >= ?', (device, restart))
+    df = read_device_rows(conn, device, restart, np.iinfo(np.int64).max)
+    store_charge_events(conn, device, df['ts'].to_numpy(dtype=np.int64), df['battery_voltage'].to_numpy(dtype=float))
+
+def backfill_charge_events(conn):
+    """Compute charge_events for every device already in gps_data."""
+    bounds = np.iinfo(np.int64)
+    for device, ts, voltages in iter_device_series(conn, bounds.min, bounds.max):
+        store_charge_events(conn, device, ts, voltages)
+
+def find_offline_periods(ts, min_gap):
+    """(start, end) ts of every gap of at least `min_gap` seconds between
+    consecutive readings in sorted `ts`: the last reading before each gap
+    and the first after it."""
+    ts = np.asarray(ts, dtype=np.int64)
+    gaps = np.flatnonzero(np.diff(ts) >= min_gap)
+    return ts[gaps], ts[gaps + 1]
+
+def store_offline_periods(conn, device, ts):
+    starts, ends = find_offline_periods(ts, app.config['OFFLINE_GAP_MINUTES'] * 60)
+    conn.executemany('''
+        INSERT OR REPLACE INTO offline_periods (device, start_ts, end_ts, duration)
+        VALUES (?, ?, ?, ?)
+    ''', zip([device] * len(starts), starts.tolist(), ends.tolist(), (ends - starts).tolist()))
+
+def update_offline_periods(conn, device, first_ts, last_ts):
+    """Recompute the offline periods of `device` that rows inserted between
+    two ts can split, shorten or close.
+
+    Only the gaps between the reading before the new rows and the reading
+    after them can change, so just that stretch is read again.
+    """
+    before = conn.execute('SELECT MAX(ts) FROM gps_readings WHERE device = ? AND ts < ?',
+                          (device, first_ts)).fetchone()[0]
+    if before is None and archived_before(conn) is not None:
+        # The reading before may already be archived
+        earlier = read_device_rows(conn, device, np.iinfo(np.int64).min, first_ts, ['ts'])['ts']
+        before = int(earlier.iloc[-1]) if len(earlier) else None
+    after = conn.execute('SELECT MIN(ts) FROM gps_readings WHERE device = ? AND ts > ?',
+                         (device, last_ts)).fetchone()[0]
+    start = first_ts if before is None else before
+    end = last_ts if after is None else after
+
+    conn.execute('DELETE FROM offline_periods WHERE device = ? AND start_ts >= ? AND start_ts < ?',
+                 (device, start, end))
+    ts = read_device_rows(conn, device, start, end + 1, ['ts'])['ts'].to_numpy(dtype=np.int64)
+    store_offline_periods(conn, device, ts)
+
+def update_device_status(conn, device, first_ts):
+    """Record the first and latest reading of `device` after rows from `first_ts` on were inserted."""
+    last_ts, last_voltage = conn.execute('''
+        SELECT ts, battery_voltage FROM gps_readings WHERE device = ?
+        ORDER BY ts DESC LIMIT 1
+    ''', (device,)).fetchone()
+    conn.execute('''
+        INSERT INTO device_status (device, first_ts, last_ts, last_voltage) VALUES (?, ?, ?, ?)
+        ON CONFLICT(device) DO UPDATE SET
+            first_ts = MIN(first_ts, excluded.first_ts),
+            last_ts = excluded.last_ts,
+            last_voltage = excluded.last_voltage
+    ''', (device, first_ts, last_ts, last_voltage))
+
+def backfill_offline_periods(conn):
+    """Compute offline_periods and device_status for every device already stored."""
+    bounds = np.iinfo(np.int64)
+    conn.execute('DELETE FROM offline_periods')
+    for device, ts, voltages in iter_device_series(conn, bounds.min, bounds.max):
+        store_offline_periods(conn, device, ts)
+        conn.execute('''
+            INSERT OR REPLACE INTO device_status (device, first_ts, last_ts, last_voltage)
+            VALUES (?, ?, ?, ?)
+        ''', (device, int(ts[0]), int(ts[-1]), float(voltages[-1])))
 
-        # ===== 2. Prepare charge details =====
-        charge_dates = []
-        highlight_x = []
-        highlight_y = []
-        highlight_text = []
+def device_bucket(device):
+    """Archive bucket of a device id; crc32 because hash() is salted per process."""
+    return zlib.crc32(str(device).encode()) % ARCHIVE_BUCKETS
 
-        for charge in charge_details:
-            try:
-                start_dt = pd.to_datetime(charge['start_time_dt'])
-                end_dt = pd.to_datetime(charge['end_time_dt'])
-               
-                charge_dates.append(start_dt)
-               
-                # Min voltage point
-                highlight_x.append(start_dt)
-                highlight_y.append(charge['start_voltage'])
-                highlight_text.append(
-                    f"Start Voltage: {charge['start_voltage']:.2f}V<br>"
-                    f"Date: {start_dt.strftime('%d-%m-%Y %I:%M %p')}"
-                )
-
-                # Max voltage point
-                highlight_x.append(end_dt)
-                highlight_y.append(charge['max_voltage'])
-                highlight_text.append(
-                    f"Max Voltage: {charge['max_voltage']:.2f}V<br>"
-                    f"Date: {end_dt.strftime('%d-%m-%Y %I:%M %p')}"
-                )
-            except (KeyError, ValueError) as e:
-                app.logger.warning(f"Skipping invalid charge entry: {e}")
-                continue
-
-        # ===== 3. Create ping count bars =====
-        ping_counts = ping_series.value_counts().sort_index()
-        ping_dates = sorted(ping_counts.index)
-       
-        fig.add_trace(go.Bar(
-            x=ping_dates,
-            y=[ping_counts.get(date, 0) for date in ping_dates],
-            name="Ping Count",
-            marker_color='rgba(54, 162, 235, 0.7)',
-            yaxis='y1',
-            hovertemplate='Date: %{x}<br>Pings: %{y}<extra></extra>'
+def archived_before(conn):
+    """ts before which gps_data rows have moved to the Parquet archive, or None."""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'archived_before'").fetchone()
+    except sqlite3.OperationalError:  # database predates the meta table
+        return None
+    return row[0] if row else None
+
+def month_start(ts):
+    return int(to_epoch(from_epoch(ts).to_period('M').start_time))
+
+def archive_gps_data(conn, older_than_days):
+    """Move every whole month of gps_data that ended at least `older_than_days`
+    ago into Parquet files under ARCHIVE_FOLDER. Returns the rows moved."""
+    if pq is None:
+        raise RuntimeError("Archiving to Parquet requires pyarrow (pip install pyarrow)")
+    cutoff = month_start(to_epoch(pd.Timestamp.now() - pd.Timedelta(days=older_than_days)))
+    first = conn.execute('SELECT MIN(ts) FROM gps_data').fetchone()[0]
+    if first is None:
+        return 0
+
+    moved = 0
+    month = month_start(first)
+    while month < cutoff:
+        next_month = month_start(month + 32 * 86400)
+        moved += archive_month(conn, month, next_month)
+        month = next_month
+    return moved
+
+def archive_month(conn, month, next_month):
+    """Move the gps_data rows of one month to one Parquet file per device bucket.
+
+    Imports start refusing rows for the month first (meta 'archiving_before'),
+    so the rows can then be streamed out without holding the write lock,
+    ARCHIVE_ROW_GROUP_ROWS at a time. A last short transaction lists the files
+    in archive_files, deletes the rows and advances archived_before.
+    """
+    with conn:
+        conn.execute('''
+            INSERT INTO meta (key, value) VALUES ('archiving_before', ?)
+            ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+        ''', (next_month,))
+
+    month_dir = os.path.join(app.config['ARCHIVE_FOLDER'], f"month={from_epoch(month):%Y-%m}")
+    run_id = uuid.uuid4().hex
+    buckets = {}
+    for device_id, device in conn.execute('SELECT id, device FROM devices ORDER BY device'):
+        buckets.setdefault(device_bucket(device), []).append(device_id)
+
+    written = []
+    moved = 0
+    try:
+        for bucket, device_ids in sorted(buckets.items()):
+            path = os.path.join(month_dir, f'bucket={bucket:02d}', f'part-{run_id}.parquet')
+            stats = write_archive_file(conn, path, device_ids, month, next_month)
+            if stats is not None:
+                written.append((path, bucket, device_ids, *stats))
+
+        with conn:
+            for path, bucket, device_ids, rows, min_ts, max_ts in written:
+                conn.execute('''
+                    INSERT INTO archive_files (path, month, bucket, rows, min_ts, max_ts)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (path, month, bucket, rows, min_ts, max_ts))
+                for i in range(0, len(device_ids), 500):
+                    batch = device_ids[i:i + 500]
+                    moved += conn.execute(f'''
+                        DELETE FROM gps_data
+                        WHERE device_id IN ({', '.join('?' * len(batch))}) AND ts >= ? AND ts < ?
+                    ''', [*batch, month, next_month]).rowcount
+            if moved != sum(file[3] for file in written):
+                raise RuntimeError(f"gps_data changed for {from_epoch(month):%Y-%m} while it was archived")
+            conn.execute('''
+                INSERT INTO meta (key, value) VALUES ('archived_before', ?)
+                ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+            ''', (next_month,))
+    except Exception:
+        for path, *_ in written:
+            os.remove(path)
+        raise
+    return moved
+
+def write_archive_file(conn, path, device_ids, month, next_month):
+    """Stream the month's rows of `device_ids` (ordered by name) into one
+    Parquet file. Returns (rows, min_ts, max_ts), or None without a file
+    when they have no rows."""
+    schema = pa.schema([('sl_no', pa.int64()), ('device', pa.string()), ('event', pa.string()),
+                        ('ts', pa.int64()), ('battery_voltage', pa.float64())])
+    writer = None
+    rows, min_ts, max_ts = 0, None, None
+    try:
+        # Device batches follow name order, so the file is sorted by device and ts
+        # and row group statistics prune on both
+        for i in range(0, len(device_ids), 500):
+            batch = device_ids[i:i + 500]
+            chunks = pd.read_sql_query(f'''
+                SELECT g.sl_no, d.device, e.event, g.ts, g.battery_voltage
+                FROM gps_data g
+                JOIN devices d ON d.id = g.device_id
+                LEFT JOIN events e ON e.id = g.event_id
+                WHERE g.device_id IN ({', '.join('?' * len(batch))}) AND g.ts >= ? AND g.ts < ?
+                ORDER BY d.device, g.ts
+            ''', conn, params=[*batch, month, next_month], chunksize=ARCHIVE_ROW_GROUP_ROWS)
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                if writer is None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = pq.ParquetWriter(path, schema, compression='zstd')
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False),
+                                   row_group_size=ARCHIVE_ROW_GROUP_ROWS)
+                rows += len(chunk)
+                low, high = int(chunk['ts'].min()), int(chunk['ts'].max())
+                min_ts = low if min_ts is None else min(min_ts, low)
+                max_ts = high if max_ts is None else max(max_ts, high)
+    except Exception:
+        if writer is not None:
+            writer.close()
+            os.remove(path)
+        raise
+    if writer is None:
+        return None
+    writer.close()
+    return rows, min_ts, max_ts
+
+def archive_dataset(conn, start_ts, end_ts, devices=None, bucket=None):
+    """(dataset, filter) for archived rows in [start_ts, end_ts), optionally
+    of some devices or one bucket, or (None, None) when no file can hold any.
+
+    Files are picked from archive_files by bucket and ts bounds; the filter
+    is pushed down to their Parquet row groups when the dataset is read.
+    """
+    buckets = [bucket] if bucket is not None else []
+    if devices is not None:
+        devices = list(devices)
+        buckets = sorted({device_bucket(device) for device in devices})
+    query = 'SELECT path FROM archive_files WHERE max_ts >= ? AND min_ts < ?'
+    params = [start_ts, end_ts]
+    if buckets:
+        query += f" AND bucket IN ({', '.join('?' * len(buckets))})"
+        params.extend(buckets)
+    paths = [path for (path,) in conn.execute(query + ' ORDER BY min_ts', params)]
+    if not paths:
+        return None, None
+    if ds is None:
+        raise RuntimeError("Reading the Parquet archive requires pyarrow (pip install pyarrow)")
+
+    condition = (ds.field('ts') >= start_ts) & (ds.field('ts') < end_ts)
+    if devices is not None:
+        condition &= ds.field('device').isin(devices)
+    return ds.dataset(paths, format='parquet'), condition
+
+def read_archive(conn, start_ts, end_ts, columns, devices=None, bucket=None):
+    """Archived rows in [start_ts, end_ts), reading only `columns`; see archive_dataset."""
+    dataset, condition = archive_dataset(conn, start_ts, end_ts, devices, bucket)
+    if dataset is None:
+        return pd.DataFrame({column: [] for column in columns})
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+def read_device_rows(conn, device, start_ts, end_ts, columns=('ts', 'battery_voltage')):
+    """Rows of one device in [start_ts, end_ts) ordered by ts, read from the
+    archive for archived months and from gps_data for the rest."""
+    columns = list(columns)
+    hot_start = start_ts
+    frames = []
+    boundary = archived_before(conn)
+    if boundary is not None and start_ts < boundary:
+        cold = read_archive(conn, start_ts, min(end_ts, boundary), columns, devices=[device])
+        frames.append(cold.sort_values('ts', kind='stable'))
+        hot_start = boundary
+    if end_ts > hot_start:
+        frames.append(pd.read_sql_query(f'''
+            SELECT {', '.join(columns)} FROM gps_readings
+            WHERE device = ? AND ts >= ? AND ts < ?
+            ORDER BY ts
+        ''', conn, params=(device, hot_start, end_ts)))
+    if not frames:
+        return pd.DataFrame({column: [] for column in columns})
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+def read_fleet_rows(conn, devices, start_ts, end_ts, columns=('ts', 'battery_voltage')):
+    """read_device_rows for several devices at once, with a device column.
+    Each device's rows are together and ordered by ts. The hot range is one
+    IN query walking the (device_id, ts) key, the cold range one archive read."""
+    columns = list(columns)
+    hot_start = start_ts
+    frames = []
+    boundary = archived_before(conn)
+    if boundary is not None and start_ts < boundary:
+        frames.append(read_archive(conn, start_ts, min(end_ts, boundary), ['device', *columns], devices=devices))
+        hot_start = boundary
+    if end_ts > hot_start:
+        names = dict(conn.execute(
+            f"SELECT id, device FROM devices WHERE device IN ({', '.join('?' * len(devices))})", devices
         ))
+        hot = pd.read_sql_query(f'''
+            SELECT device_id, {', '.join(columns)} FROM gps_data
+            WHERE device_id IN ({', '.join('?' * len(names))}) AND ts >= ? AND ts < ?
+            ORDER BY device_id, ts
+        ''', conn, params=(*names, hot_start, end_ts))
+        hot.insert(0, 'device', hot.pop('device_id').map(names))
+        frames.append(hot)
+    if not frames:
+        return pd.DataFrame({column: [] for column in ['device', *columns]})
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True).sort_values(['device', 'ts'], kind='stable', ignore_index=True)
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points kept by largest-triangle-three-buckets downsampling.
+
+    The first and last points are always kept; the rest are split into
+    threshold - 2 buckets and from each the point forming the largest triangle
+    with the previously kept point and the next bucket's average is chosen.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    edges = np.append(edges, n)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2]
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + area.argmax()
+        selected[i + 1] = a
+    return selected
+
+def minmax_indices(values, buckets):
+    """Indices of the lowest and highest value in each of `buckets` equal
+    slices, plus the first and last. Unlike LTTB it needs no loop, which
+    matters when a chart holds many small series."""
+    n = len(values)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    bucket = np.arange(n) * buckets // n
+    # Sorted by bucket then value, so each bucket's minimum leads and its maximum trails
+    order = np.lexsort((values, bucket))
+    firsts = np.searchsorted(bucket, np.arange(buckets))
+    lasts = np.append(firsts[1:], n) - 1
+    return np.union1d(np.concatenate([order[firsts], order[lasts]]), [0, n - 1])
+
+def downsample_voltage(ts, voltages, keep_ts, max_points, method='lttb'):
+    """Indices of about `max_points` readings chosen by LTTB (or per-bucket
+    min/max with method='minmax'), plus the readings at every ts in `keep_ts`
+    (charge start and max points)."""
+    if len(ts) <= max_points:
+        return np.arange(len(ts))
+
+    if method == 'minmax':
+        keep = minmax_indices(voltages, max_points // 2)
+    else:
+        keep = lttb_indices(ts, voltages, max_points)
+    if len(keep_ts):
+        extra = np.searchsorted(ts, keep_ts)
+        keep = np.union1d(keep, extra[extra < len(ts)])
+    return keep
+
+_result_cache = OrderedDict()
+_result_cache_state = {'version': None, 'bytes': 0, 'hits': 0, 'misses': 0}
+_result_cache_lock = threading.Lock()
+
+def cached_result(conn, key, compute):
+    """Return compute() for `key`, reusing the result while the data version is unchanged.
+
+    Results are kept pickled, least recently used first, up to
+    RESULT_CACHE_BYTES. The version is read before computing, so an entry
+    is never older than the version it is stored under.
+    """
+    version = data_version(conn)
+    with _result_cache_lock:
+        if _result_cache_state['version'] != version:
+            # An import landed since the cache was filled
+            _result_cache.clear()
+            _result_cache_state.update(version=version, bytes=0)
+        blob = _result_cache.get(key)
+        if blob is not None:
+            _result_cache.move_to_end(key)
+            _result_cache_state['hits'] += 1
+            return pickle.loads(blob)
+        _result_cache_state['misses'] += 1
+
+    value = compute()
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    max_bytes = app.config['RESULT_CACHE_BYTES']
+    if len(blob) > max_bytes:
+        return value
+
+    with _result_cache_lock:
+        if _result_cache_state['version'] == version and key not in _result_cache:
+            _result_cache[key] = blob
+            _result_cache_state['bytes'] += len(blob)
+            while _result_cache_state['bytes'] > max_bytes:
+                _, evicted = _result_cache.popitem(last=False)
+                _result_cache_state['bytes'] -= len(evicted)
+    return value
+
+def load_charge_details(conn, device, start_ts, end_ts):
+    """Precomputed charge cycles starting in [start_ts, end_ts), formatted for display."""
+    rows = conn.execute('''
+        SELECT start_ts, end_ts, start_voltage, max_voltage FROM charge_events
+        WHERE device = ? AND start_ts >= ? AND start_ts < ?
+        ORDER BY start_ts
+    ''', (device, start_ts, end_ts)).fetchall()
+    return [
+        format_charge(from_epoch(start), from_epoch(end), start_voltage, max_voltage)
+        for start, end, start_voltage, max_voltage in rows
+    ]
+
+def load_offline_periods(conn, device, start_ts, end_ts, min_seconds):
+    """Offline periods of at least `min_seconds` overlapping [start_ts, end_ts), formatted for display."""
+    rows = conn.execute('''
+        SELECT start_ts, end_ts FROM offline_periods
+        WHERE device = ? AND start_ts < ? AND end_ts > ? AND duration >= ?
+        ORDER BY start_ts
+    ''', (device, end_ts, start_ts, min_seconds)).fetchall()
+    return [
+        {
+            'last_seen': from_epoch(start).strftime('%d-%m-%Y %I:%M %p'),
+            'back_online': from_epoch(end).strftime('%d-%m-%Y %I:%M %p'),
+            'duration': format_duration(end - start),
+        }
+        for start, end in rows
+    ]
+
+def device_timeseries_payload(conn, device, start_ts, end_ts, max_points):
+    """Columnar chart data for one device: daily ping counts and the downsampled voltage trace."""
+    with stage('timeseries.daily_stats') as timing:
+        daily = pd.read_sql_query('''
+            SELECT day, pings + reboots AS pings FROM daily_device_stats
+            WHERE device = ? AND day >= ? AND day < ? AND pings + reboots > 0
+            ORDER BY day
+        ''', conn, params=(device, start_ts, end_ts))
+        timing['rows'] = len(daily)
+    with stage('timeseries.voltage') as timing:
+        voltage = read_device_rows(conn, device, start_ts, end_ts).dropna(subset=['battery_voltage'])
+        timing['rows'] = len(voltage)
+    keep_ts = np.array([ts for row in conn.execute('''
+        SELECT start_ts, end_ts FROM charge_events
+        WHERE device = ? AND start_ts >= ? AND start_ts < ?
+    ''', (device, start_ts, end_ts)) for ts in row], dtype=np.int64)
+
+    ts = voltage['ts'].to_numpy(dtype=np.int64)
+    voltages = voltage['battery_voltage'].to_numpy(dtype=float)
+    with stage('timeseries.downsample') as timing:
+        keep = downsample_voltage(ts, voltages, keep_ts, max_points)
+        timing['rows'] = len(keep)
+    return {
+        'device': device,
+        'daily': {'day': daily['day'].tolist(), 'pings': daily['pings'].tolist()},
+        'voltage': {'ts': ts[keep].tolist(), 'v': voltages[keep].tolist()},
+        'voltage_points': len(ts),
+        'voltage_points_shown': len(keep),
+    }
 
-        # ===== 4. Add battery voltage line =====
-        if not full_voltage_df.empty:
-            fig.add_trace(go.Scatter(
-                x=full_voltage_df['tracking_date'],
-                y=full_voltage_df['battery_voltage'],
-                mode='lines',
-                name='Battery Voltage',
-                line=dict(color='orange', width=2),
-                yaxis='y2',
-                hovertemplate='Date: %{x|%d-%m-%Y %I:%M %p}<br>Voltage: %{y:.2f}V<extra></extra>'
-            ))
-
-        # ===== 5. Add charge markers =====
-        if highlight_x:
-            fig.add_trace(go.Scatter(
-                x=highlight_x,
-                y=highlight_y,
-                mode='markers',
-                name='Charge Min/Max Points',
-                marker=dict(color='orange', size=8, symbol='circle'),
-                yaxis='y2',
-                text=highlight_text,
-                hoverinfo='text'
-            ))
-
-        # ===== 6. Handle date ranges and monthly grouping =====
-        min_date = ping_series.min()
-        max_date = ping_series.max()
-        date_range = (max_date - min_date).days
-
-        # Determine if we should show monthly or daily ticks
-        if date_range > 60:  # More than 2 months - use monthly grouping
-            monthly_pings = ping_series.groupby([
-                ping_series.dt.year.rename('year'),
-                ping_series.dt.month.rename('month')
-            ]).size()
-           
-            if charge_dates:
-                charge_series = pd.Series(charge_dates)
-                monthly_charges = charge_series.groupby([
-                    charge_series.dt.year.rename('year'),
-                    charge_series.dt.month.rename('month')
-                ]).size()
-            else:
-                monthly_charges = pd.Series(dtype=int)
-           
-            # Create month labels
-            all_months = set()
-            for dt in ping_dates:
-                all_months.add((dt.year, dt.month))
-            if charge_dates:
-                for dt in charge_dates:
-                    all_months.add((dt.year, dt.month))
-           
-            sorted_months = sorted(all_months)
-            month_centers = []
-            month_labels = []
-           
-            for year, month in sorted_months:
-                middle = datetime(year, month, 15, 12, 0, 0)
-                month_centers.append(middle)
-                ping_count = monthly_pings.get((year, month), 0)
-                charge_count = monthly_charges.get((year, month), 0)
-                month_labels.append(f"{middle.strftime('%b %Y')}<br>Pings: {ping_count} | Charges: {charge_count}")
-               
-                # Add vertical lines for month starts
-                if datetime(year, month, 1) > min_date:
-                    fig.add_vline(
-                        x=datetime(year, month, 1),
-                        line_dash="dot",
-                        line_color="gray",
-                        line_width=1,
-                        opacity=0.5
-                    )
-           
-            xaxis_config = {
-                'title': "Month",
-                'tickvals': month_centers,
-                'ticktext': month_labels,
-                'tickangle': 0,
-                'tickfont': dict(size=10)
-            }
-        else:
-            # For short ranges (<2 months), use daily ticks
-            xaxis_config = {
-                'title': "Date",
-                'tickformat': "%d %b",
-                'tickangle': 45
-            }
-
-        # ===== 7. Final layout =====
-        fig.update_layout(
-            title=dict(text=title, x=0.5),
-            xaxis=xaxis_config,
-            yaxis=dict(title="Ping Count", side='left', showgrid=False),
-            yaxis2=dict(
-                title="Battery Voltage (V)",
-                overlaying='y',
-                side='right',
-                showgrid=False,
-                range=[2.8, 4.4]
-            ),
-            legend=dict(orientation="h", y=1.1, x=1, xanchor="right"),
-            margin=dict(l=40, r=40, t=50, b=120),
-            height=450,
-            dragmode=False
-        )
+def device_charges_payload(conn, device, start_ts, end_ts):
+    """Columnar charge cycles starting in [start_ts, end_ts)."""
+    with stage('charges.read') as timing:
+        charges = pd.read_sql_query('''
+            SELECT start_ts, end_ts, start_voltage, max_voltage FROM charge_events
+            WHERE device = ? AND start_ts >= ? AND start_ts < ?
+            ORDER BY start_ts
+        ''', conn, params=(device, start_ts, end_ts))
+        timing['rows'] = len(charges)
+    long_offline = charges['end_ts'] - charges['start_ts'] >= LONG_OFFLINE_DAYS * 86400
+    return {
+        'device': device,
+        'start_ts': charges['start_ts'].tolist(),
+        'end_ts': charges['end_ts'].tolist(),
+        'start_voltage': charges['start_voltage'].tolist(),
+        'max_voltage': charges['max_voltage'].tolist(),
+        'long_offline': long_offline.tolist(),
+    }
 
-        return pio.to_html(
-            fig,
-            full_html=False,
-            include_plotlyjs='cdn',
-            config={
-                'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
-                'scrollZoom': False,
-                'displayModeBar': True,
-                'displaylogo': False
-            }
-        )
+def comparison_timeseries_payload(conn, devices, start_ts, end_ts, max_points):
+    """Chart data for a device comparison: each device's downsampled voltage
+    trace and charge cycles, from one read of all their rows."""
+    with stage('compare.voltage') as timing:
+        voltage = read_fleet_rows(conn, devices, start_ts, end_ts).dropna(subset=['battery_voltage'])
+        timing['rows'] = len(voltage)
+    with stage('compare.charges') as timing:
+        charges = pd.read_sql_query(f'''
+            SELECT device, start_ts, end_ts, start_voltage, max_voltage FROM charge_events
+            WHERE device IN ({', '.join('?' * len(devices))}) AND start_ts >= ? AND start_ts < ?
+            ORDER BY device, start_ts
+        ''', conn, params=(*devices, start_ts, end_ts))
+        timing['rows'] = len(charges)
+
+    series = {device: group for device, group in voltage.groupby('device', sort=False)}
+    cycles = {device: group for device, group in charges.groupby('device', sort=False)}
+    payload = []
+    with stage('compare.downsample') as timing:
+        for device in devices:
+            readings = series.get(device, voltage.iloc[:0])
+            ts = readings['ts'].to_numpy(dtype=np.int64)
+            voltages = readings['battery_voltage'].to_numpy(dtype=float)
+            device_charges = cycles.get(device, charges.iloc[:0])
+            keep_ts = device_charges[['start_ts', 'end_ts']].to_numpy(dtype=np.int64).ravel()
+            keep = downsample_voltage(ts, voltages, keep_ts, max_points, method='minmax')
+            payload.append({
+                'device': device,
+                'voltage': {'ts': ts[keep].tolist(), 'v': voltages[keep].tolist()},
+                'voltage_points': len(ts),
+                'charges': {column: device_charges[column].tolist()
+                            for column in ('start_ts', 'end_ts', 'start_voltage', 'max_voltage')},
+            })
+        timing['rows'] = sum(len(item['voltage']['ts']) for item in payload)
+    return {'devices': payload}
+
+# Columns and dtypes of each export, fixed so every batch (even an empty
+# one) writes the same CSV header and Parquet schema
+EXPORT_DTYPES = {
+    'pings': {'device': 'string', 'tracking_date': 'datetime64[ns]', 'sl_no': 'int64',
+              'event': 'string', 'battery_voltage': 'float64'},
+    'daily': {'device': 'string', 'date': 'string', 'pings': 'int64', 'reboots': 'int64', 'samples': 'int64',
+              'min_voltage': 'float64', 'max_voltage': 'float64', 'avg_voltage': 'float64'},
+    'charges': {'device': 'string', 'start_time': 'datetime64[ns]', 'end_time': 'datetime64[ns]',
+                'start_voltage': 'float64', 'max_voltage': 'float64', 'duration_minutes': 'int64',
+                'long_offline': 'bool'},
+}
+
+def iter_export_pings(conn, devices, start_ts, end_ts):
+    """Raw readings one device at a time: archived months as Parquet record
+    batches, then gps_data through a fetchmany cursor, EXPORT_BATCH_ROWS at a time."""
+    boundary = archived_before(conn)
+    for device in devices:
+        hot_start = start_ts
+        if boundary is not None and start_ts < boundary:
+            dataset, condition = archive_dataset(conn, start_ts, min(end_ts, boundary), devices=[device])
+            if dataset is not None:
+                for batch in dataset.to_batches(columns=['device', 'ts', 'sl_no', 'event', 'battery_voltage'],
+                                                filter=condition, batch_size=EXPORT_BATCH_ROWS):
+                    yield batch.to_pandas()
+            hot_start = boundary
+        if end_ts > hot_start:
+            yield from pd.read_sql_query('''
+                SELECT device, ts, sl_no, event, battery_voltage FROM gps_readings
+                WHERE device = ? AND ts >= ? AND ts < ?
+                ORDER BY ts
+            ''', conn, params=(device, hot_start, end_ts), chunksize=EXPORT_BATCH_ROWS)
+
+def export_frames(conn, dataset, devices, start_ts, end_ts):
+    """Yield an export as DataFrames of at most EXPORT_BATCH_ROWS rows with
+    the columns and dtypes of EXPORT_DTYPES[dataset]."""
+    placeholders = ', '.join('?' * len(devices))
+    if dataset == 'pings':
+        frames = iter_export_pings(conn, devices, start_ts, end_ts)
+    elif dataset == 'daily':
+        frames = pd.read_sql_query(f'''
+            SELECT device, day, pings, reboots, samples, min_voltage, max_voltage, avg_voltage
+            FROM daily_device_stats
+            WHERE device IN ({placeholders}) AND day >= ? AND day < ?
+            ORDER BY device, day
+        ''', conn, params=(*devices, start_ts, end_ts), chunksize=EXPORT_BATCH_ROWS)
+    else:
+        frames = pd.read_sql_query(f'''
+            SELECT device, start_ts, end_ts, start_voltage, max_voltage FROM charge_events
+            WHERE device IN ({placeholders}) AND start_ts >= ? AND start_ts < ?
+            ORDER BY device, start_ts
+        ''', conn, params=(*devices, start_ts, end_ts), chunksize=EXPORT_BATCH_ROWS)
+
+    dtypes = EXPORT_DTYPES[dataset]
+    for frame in frames:
+        if dataset == 'pings':
+            frame['tracking_date'] = from_epoch(frame.pop('ts').astype('int64'))
+        elif dataset == 'daily':
+            frame['date'] = from_epoch(frame.pop('day').astype('int64')).dt.strftime('%Y-%m-%d')
+        else:
+            start, end = frame.pop('start_ts').astype('int64'), frame.pop('end_ts').astype('int64')
+            frame['start_time'], frame['end_time'] = from_epoch(start), from_epoch(end)
+            frame['duration_minutes'] = (end - start) // 60
+            frame['long_offline'] = end - start >= LONG_OFFLINE_DAYS * 86400
+        yield frame[list(dtypes)].astype(dtypes)
+
+def csv_chunks(frames, columns):
+    """One CSV document from DataFrames, encoded a frame at a time."""
+    yield ','.join(columns) + '\n'
+    for frame in frames:
+        yield frame.to_csv(index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+
+class ExportSink:
+    """Write-only file for pq.ParquetWriter that hands out what was written
+    since the last take(), so a Parquet file can be streamed as it is built."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def parquet_chunks(frames, dtypes):
+    """One Parquet file from DataFrames, a row group per frame."""
+    schema = pa.Schema.from_pandas(pd.DataFrame({c: pd.Series(dtype=t) for c, t in dtypes.items()}),
+                                   preserve_index=False)
+    sink = ExportSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    for frame in frames:
+        writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def parse_api_range():
+    """Half-open epoch bounds from the ?from=YYYY-MM-DD&to=YYYY-MM-DD query args."""
+    try:
+        return date_range_bounds(pd.to_datetime(request.args['from']), pd.to_datetime(request.args['to']))
+    except (KeyError, ValueError):
+        abort(400)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    seconds = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    size = response.calculate_content_length()
+    observe('asset_tracker_request_seconds', seconds, endpoint=endpoint, method=request.method)
+    increment('asset_tracker_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    if size is not None:
+        observe('asset_tracker_response_bytes', size, SIZE_BUCKETS, endpoint=endpoint)
+    if seconds >= app.config['SLOW_REQUEST_SECONDS']:
+        app.logger.warning('slow request %s', json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'seconds': round(seconds, 3),
+            'bytes': size,
+            'stages': summarize_stages(g.get('stages', [])),
+        }))
+    return response
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/csv', 'text/css',
+                          'application/json', 'application/javascript'}
+
+def preferred_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip member
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+@app.after_request
+def compress_response(response):
+    """Compress text responses of at least COMPRESS_MIN_BYTES (any size when
+    streamed) with brotli or gzip, whichever the client accepts."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    encoding = preferred_encoding()
+    if encoding is None:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        response.set_data(brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, 6))
+    response.content_encoding = encoding
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+def data_etag(view):
+    """Answer a GET view conditionally. Its strong ETag hashes the path, the
+    query arguments, the data version and this code. A matching If-None-Match
+    gets a 304 before the view runs."""
+    @wraps(view)
+    def conditional_view(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        with get_db() as conn:
+            version = data_version(conn)
+        key = json.dumps([request.path, sorted(request.args.items(multi=True)), version, CODE_VERSION])
+        etag = hashlib.sha1(key.encode()).hexdigest()
+        for candidate in (etag, f'{etag}-gzip', f'{etag}-br'):
+            if request.if_none_match.contains(candidate):
+                response = app.response_class(status=304)
+                response.set_etag(candidate)
+                response.vary.add('Accept-Encoding')
+                return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+        return response
+    return conditional_view
+
+@app.route('/metrics')
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-    except Exception as e:
-        app.logger.error(f"Error in create_combined_chart: {str(e)}")
-        return None
 @app.route('/')
 def landing():
-    return render_template_string(LANDING_TEMPLATE)
+    return static_page(LANDING_PAGE)
 
 @app.route('/tracker', methods=['GET', 'POST'])
+@data_etag
 def tracker():
     result = None
-    combined_chart = None
-    upload_success = False
+    comparison = None
+    job_id = None
     device_prefill = request.args.get('device', '')
 
     if request.method == 'POST' and 'file' in request.files:
         file = request.files['file']
         if file and allowed_file(file.filename):
             try:
-                filename = secure_filename(f"{uuid.uuid4()}.csv")
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-
                 # Get selected date format (default to mm/dd/yyyy if not specified)
                 date_format = request.form.get('date_format', 'mmddyyyy')
 
-                # Check file type by looking at columns
-                df_preview = pd.read_csv(file_path, nrows=5)
-                cols = df_preview.columns.str.lower().str.replace(' ', '_')
-                if set(['device_id', 'region', 'branch']).issubset(cols):
-                    init_device_info_table()
-                    import_device_info(file_path)
+                # File type, encoding and delimiter come from the header, checked before saving
+                file_path, kind, read_options = save_upload(file)
+                if kind == 'device_info':
+                    job_id = submit_import(import_device_info, file_path, **read_options)
                 else:
-                    init_db()
-                    import_csv(file_path, date_format=date_format)
-               
-                upload_success = True
-                os.remove(file_path)
+                    job_id = submit_import(import_csv, file_path, date_format=date_format, **read_options)
             except Exception as e:
-                return render_template_string(TRACKER_TEMPLATE,
-                                           error_message=f"Error processing file: {str(e)}")
-
-    elif all(k in request.form for k in ('device', 'from_date', 'to_date')):
-        device = request.form['device'].strip()
-        from_date_raw = request.form['from_date']
-        to_date_raw = request.form['to_date']
+                return render_template(TRACKER_PAGE,
+                                       error_message=f"Error processing file: {str(e)}")
+
+    elif all(k in request.values for k in ('device', 'from_date', 'to_date')):
+        # Searched with GET so that a repeat search can be answered with a 304
+        device = request.values['device'].strip()
+        from_date_raw = request.values['from_date']
+        to_date_raw = request.values['to_date']
        
         try:
-            from_date = pd.to_datetime(from_date_raw, dayfirst=True).strftime('%Y-%m-%d')
-            to_date = pd.to_datetime(to_date_raw, dayfirst=True).strftime('%Y-%m-%d')
+            start_ts, end_ts = date_range_bounds(pd.to_datetime(from_date_raw, dayfirst=True),
+                                                 pd.to_datetime(to_date_raw, dayfirst=True))
         except Exception as e:
-            return render_template_string(TRACKER_TEMPLATE,
-                                       error_message=f"Invalid date format: {str(e)}")
-
-        with sqlite3.connect(DB_NAME) as conn:
-            # Get GPS data
-            df = pd.read_sql_query('''
-                SELECT * FROM gps_data
-                WHERE device = ?
-                  AND DATE(tracking_date) BETWEEN DATE(?) AND DATE(?)
-                ORDER BY tracking_date
-            ''', conn, params=(device, from_date, to_date))
-
-            # Get device info
-            cur = conn.cursor()
-            cur.execute('SELECT region, branch FROM device_info WHERE device = ?', (device,))
-            info = cur.fetchone()
-
-        if not df.empty:
-            df['event'] = df['event'].astype(str).str.strip().str.upper()
-            df['tracking_date'] = pd.to_datetime(df['tracking_date'], errors='coerce')
-
-            # Process pings
-            pings = df[df['event'].isin(['G_PING', 'REBOOT'])]
-            ping_dates = pings['tracking_date'].dt.date
-
-            # Process charges - now returns detailed charge information
-            charge_details = detect_charges(df)
+            return render_template(TRACKER_PAGE,
+                                   error_message=f"Invalid date format: {str(e)}")
+
+        with get_db() as conn:
+            pings, days, charge_details, offline_periods, info = cached_result(
+                conn, ('search', device, start_ts, end_ts),
+                lambda: device_search_summary(conn, device, start_ts, end_ts)
+            )
 
+        if days:
+            # The chart is drawn in the browser from the JSON API
+            api_range = {
+                'from': from_epoch(start_ts).strftime('%Y-%m-%d'),
+                'to': (from_epoch(end_ts) - timedelta(days=1)).strftime('%Y-%m-%d')
+            }
             result = {
                 'device': device,
                 'from_date': from_date_raw,
                 'to_date': to_date_raw,
-                'pings': len(ping_dates),
+                'pings': pings,
                 'charges': len(charge_details),
                 'charge_details': charge_details,
-                'long_offline_count': sum(1 for c in charge_details if c['is_long_offline'])
+                'long_offline_count': sum(1 for c in charge_details if c['is_long_offline']),
+                'offline_periods': offline_periods,
+                'timeseries_url': url_for('device_timeseries', device=device, **api_range),
+                'charges_url': url_for('device_charges', device=device, **api_range),
+                'export_args': {'device': device, **api_range}
             }
 
             if info:
                 result['region'] = info[0]
                 result['branch'] = info[1]
 
-            if not ping_dates.empty or charge_details:
-                # Extract just the dates for the chart
-                charge_dates = pd.Series([c['start_time_dt'].date() for c in charge_details])
-                full_voltage_df = df[['tracking_date', 'battery_voltage']].dropna()
-                combined_chart = create_combined_chart(ping_dates, charge_details, full_voltage_df)
-
-    return render_template_string(
-        TRACKER_TEMPLATE,
-        result=result,
-        combined_chart=combined_chart,
-        upload_success=upload_success,
-        device_prefill=device_prefill
-    )
+    elif 'compare' in request.values and all(k in request.values for k in ('from_date', 'to_date')):
+        from_date_raw = request.values['from_date']
+        to_date_raw = request.values['to_date']
+        try:
+            start_ts, end_ts = date_range_bounds(pd.to_datetime(from_date_raw, dayfirst=True),
+                                                 pd.to_datetime(to_date_raw, dayfirst=True))
+        except Exception as e:
+            return render_template(TRACKER_PAGE,
+                                   error_message=f"Invalid date format: {str(e)}")
+
+        # Either the typed device IDs or every device of the chosen branch
+        devices = parse_device_list(request.values.get('devices', ''))
+        region = request.values.get('region', '')
+        branch = request.values.get('branch', '')
+        label = f"{len(devices)} device(s)"
+        selection = {'devices': ','.join(devices)}
+        if not devices and region and branch:
+            with get_db() as conn:
+                devices = branch_devices(conn, region, branch)
+            label = f"Branch {branch} ({region})"
+            selection = {'region': region, 'branch': branch}
+        if not devices:
+            return render_template(TRACKER_PAGE,
+                                   error_message="Enter device IDs or choose a branch to compare.")
+        total = len(devices)
+        devices = devices[:app.config['COMPARE_MAX_DEVICES']]
+
+        with get_db() as conn:
+            rows = cached_result(
+                conn, ('compare', tuple(devices), start_ts, end_ts),
+                lambda: device_comparison_summary(conn, devices, start_ts, end_ts)
+            )
+        api_range = {
+            'from': from_epoch(start_ts).strftime('%Y-%m-%d'),
+            'to': (from_epoch(end_ts) - timedelta(days=1)).strftime('%Y-%m-%d')
+        }
+        comparison = {
+            'label': label,
+            'from_date': from_date_raw,
+            'to_date': to_date_raw,
+            'devices': rows,
+            'total': total,
+            'timeseries_url': url_for('comparison_timeseries', devices=','.join(devices), **api_range),
+            'export_args': {**selection, **api_range}
+        }
+
+    with stage('tracker.render') as timing:
+        html = render_template(
+            TRACKER_PAGE,
+            result=result,
+            comparison=comparison,
+            job_id=job_id,
+            device_prefill=device_prefill
+        )
+        timing['bytes'] = len(html)
+    return html
+
+def device_search_summary(conn, device, start_ts, end_ts):
+    """Ping total, days with data, charge cycles, offline periods and (region,
+    branch) for a /tracker search."""
+    # Ping totals come from the rollup maintained at import
+    with stage('search.daily_stats') as timing:
+        pings, days = conn.execute('''
+            SELECT SUM(pings + reboots), COUNT(*) FROM daily_device_stats
+            WHERE device = ? AND day >= ? AND day < ?
+        ''', (device, start_ts, end_ts)).fetchone()
+        timing['rows'] = days
+
+    # Charge cycles are precomputed at import
+    with stage('search.charges') as timing:
+        charge_details = load_charge_details(conn, device, start_ts, end_ts)
+        timing['rows'] = len(charge_details)
+
+    # Gaps in the pings, recorded at import independently of charging
+    with stage('search.offline') as timing:
+        offline_periods = load_offline_periods(conn, device, start_ts, end_ts,
+                                               app.config['OFFLINE_AFTER_HOURS'] * 3600)
+        timing['rows'] = len(offline_periods)
+
+    # Get device info
+    with stage('search.device_info'):
+        cur = conn.cursor()
+        cur.execute('SELECT region, branch FROM device_info WHERE device = ?', (device,))
+        info = cur.fetchone()
+    return pings, days, charge_details, offline_periods, info
+
+def parse_device_list(text):
+    """Device IDs typed into the comparison form, in order and without repeats."""
+    return list(dict.fromkeys(re.split(r'[\s,;]+', text.strip()))) if text.strip() else []
+
+def branch_devices(conn, region, branch):
+    return [device for (device,) in conn.execute(
+        'SELECT device FROM device_info WHERE region = ? AND branch = ? ORDER BY device', (region, branch)
+    )]
+
+def device_comparison_summary(conn, devices, start_ts, end_ts):
+    """One summary row per device for a comparison search. Each rollup table
+    is read with a single IN query, so the cost barely grows with the device count."""
+    placeholders = ', '.join('?' * len(devices))
+    with stage('compare.daily_stats') as timing:
+        stats = {row[0]: row[1:] for row in conn.execute(f'''
+            SELECT device, SUM(pings + reboots), COUNT(*), MIN(min_voltage), MAX(max_voltage), MAX(day)
+            FROM daily_device_stats
+            WHERE device IN ({placeholders}) AND day >= ? AND day < ?
+            GROUP BY device
+        ''', (*devices, start_ts, end_ts))}
+        timing['rows'] = len(stats)
+    with stage('compare.charges') as timing:
+        charges = {row[0]: row[1:] for row in conn.execute(f'''
+            SELECT device, COUNT(*), SUM(end_ts - start_ts >= ?) FROM charge_events
+            WHERE device IN ({placeholders}) AND start_ts >= ? AND start_ts < ?
+            GROUP BY device
+        ''', (LONG_OFFLINE_DAYS * 86400, *devices, start_ts, end_ts))}
+        timing['rows'] = len(charges)
+    with stage('compare.offline') as timing:
+        offline = {row[0]: row[1:] for row in conn.execute(f'''
+            SELECT device, COUNT(*), MAX(duration) FROM offline_periods
+            WHERE device IN ({placeholders}) AND start_ts < ? AND end_ts > ? AND duration >= ?
+            GROUP BY device
+        ''', (*devices, end_ts, start_ts, app.config['OFFLINE_AFTER_HOURS'] * 3600))}
+        timing['rows'] = len(offline)
+    with stage('compare.device_info'):
+        info = {row[0]: row[1:] for row in conn.execute(
+            f'SELECT device, region, branch FROM device_info WHERE device IN ({placeholders})', devices
+        )}
+
+    rows = []
+    for device in devices:
+        pings, days, min_voltage, max_voltage, last_day = stats.get(device, (0, 0, None, None, None))
+        charge_count, long_offline = charges.get(device, (0, 0))
+        offline_periods, longest_gap = offline.get(device, (0, None))
+        region, branch = info.get(device, (None, None))
+        rows.append({
+            'device': device,
+            'region': region,
+            'branch': branch,
+            'pings': pings or 0,
+            'days': days,
+            'charges': charge_count,
+            'long_offline_count': long_offline or 0,
+            'offline_periods': offline_periods,
+            'longest_gap': format_duration(longest_gap) if longest_gap is not None else None,
+            'min_voltage': min_voltage,
+            'max_voltage': max_voltage,
+            'last_day': from_epoch(last_day).strftime('%d-%m-%Y') if last_day is not None else None,
+        })
+    return rows
+
+def job_payload(row):
+    job = dict(row)
+    if job['status'] in ('queued', 'running') and not import_worker_alive(job['worker_pid']):
+        # Recorded as failed by the next fail_orphaned_import_jobs; polls are read-only
+        job['status'], job['error'] = 'failed', ORPHANED_JOB_ERROR
+    if job['started_at']:
+        started = datetime.fromisoformat(job['started_at'])
+        finished = datetime.fromisoformat(job['finished_at']) if job['finished_at'] else datetime.now()
+        job['elapsed_seconds'] = (finished - started).total_seconds()
+    else:
+        job['elapsed_seconds'] = None
+    return job
+
+@app.route('/jobs')
+def job_list():
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        rows = cur.execute('SELECT * FROM import_jobs ORDER BY rowid DESC LIMIT 20').fetchall()
+    return jsonify([job_payload(row) for row in rows])
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        row = cur.execute('SELECT * FROM import_jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        abort(404)
+    return jsonify(job_payload(row))
+
+@app.route('/api/devices/<device>/timeseries')
+@data_etag
+def device_timeseries(device):
+    start_ts, end_ts = parse_api_range()
+    max_points = request.args.get('points', app.config['CHART_MAX_POINTS'], type=int)
+    with get_db() as conn:
+        payload = cached_result(
+            conn, ('timeseries', device, start_ts, end_ts, max_points),
+            lambda: device_timeseries_payload(conn, device, start_ts, end_ts, max_points)
+        )
+    return jsonify(payload)
+
+@app.route('/api/compare/timeseries')
+@data_etag
+def comparison_timeseries():
+    """Voltage traces and charge cycles of ?devices=A,B,C for the comparison chart."""
+    start_ts, end_ts = parse_api_range()
+    devices = parse_device_list(request.args.get('devices', ''))[:app.config['COMPARE_MAX_DEVICES']]
+    if not devices:
+        abort(400)
+    max_points = request.args.get('points', app.config['COMPARE_CHART_POINTS'], type=int)
+    with get_db() as conn:
+        payload = cached_result(
+            conn, ('compare-timeseries', tuple(devices), start_ts, end_ts, max_points),
+            lambda: comparison_timeseries_payload(conn, devices, start_ts, end_ts, max_points)
+        )
+    return jsonify(payload)
+
+@app.route('/api/export/<dataset>')
+@data_etag
+def export(dataset):
+    """Stream the pings, daily summary or charge cycles of ?device=, ?devices=A,B
+    or ?region=&branch= over ?from=&to= as CSV, or Parquet with ?format=parquet."""
+    if dataset not in EXPORT_DTYPES:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'parquet') or (fmt == 'parquet' and pq is None):
+        abort(400)
+    start_ts, end_ts = parse_api_range()
+
+    devices = parse_device_list(request.args.get('devices', request.args.get('device', '')))
+    name = devices[0] if len(devices) == 1 else f'{len(devices)}-devices'
+    region, branch = request.args.get('region'), request.args.get('branch')
+    if not devices and region and branch:
+        devices = branch_devices(get_db(), region, branch)
+        name = f'{region}-{branch}'
+    if not devices:
+        abort(400)
+
+    def counted(frames):
+        rows = 0
+        for frame in frames:
+            rows += len(frame)
+            yield frame
+        increment('asset_tracker_export_rows_total', rows, dataset=dataset, format=fmt)
+
+    # Nothing is queried until the response is iterated, one batch per chunk sent
+    frames = counted(export_frames(get_db(), dataset, devices, start_ts, end_ts))
+    dtypes = EXPORT_DTYPES[dataset]
+    filename = secure_filename(f"{name}_{dataset}_{request.args['from']}_{request.args['to']}.{fmt}")
+    if fmt == 'parquet':
+        body, mimetype = parquet_chunks(frames, dtypes), 'application/vnd.apache.parquet'
+    else:
+        body, mimetype = csv_chunks(frames, list(dtypes)), 'text/csv'
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/devices/<device>/charges')
+@data_etag
+def device_charges(device):
+    start_ts, end_ts = parse_api_range()
+    with get_db() as conn:
+        payload = cached_result(
+            conn, ('charges', device, start_ts, end_ts),
+            lambda: device_charges_payload(conn, device, start_ts, end_ts)
+        )
+    return jsonify(payload)
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Hit/miss counters and size of this worker process's result cache."""
+    with _result_cache_lock:
+        lookups = _result_cache_state['hits'] + _result_cache_state['misses']
+        return jsonify({
+            'hits': _result_cache_state['hits'],
+            'misses': _result_cache_state['misses'],
+            'hit_rate': _result_cache_state['hits'] / lookups if lookups else None,
+            'entries': len(_result_cache),
+            'bytes': _result_cache_state['bytes'],
+            'max_bytes': app.config['RESULT_CACHE_BYTES'],
+            'data_version': _result_cache_state['version'],
+        })
+
+@app.route('/api/charge-summary')
+@data_etag
+def charge_summary():
+    """Fleet charge summary for ?from=YYYY-MM-DD&to=YYYY-MM-DD, or the latest batch run."""
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        if 'from' in request.args and 'to' in request.args:
+            start_ts, end_ts = parse_api_range()
+        else:
+            latest = cur.execute('''
+                SELECT period_start, period_end FROM charge_summary
+                ORDER BY computed_at DESC LIMIT 1
+            ''').fetchone()
+            if latest is None:
+                abort(404)
+            start_ts, end_ts = latest
+        rows = cur.execute('''
+            SELECT device, charges, long_offline, samples, computed_at FROM charge_summary
+            WHERE period_start = ? AND period_end = ?
+            ORDER BY device
+        ''', (start_ts, end_ts)).fetchall()
+    if not rows:
+        abort(404)
+
+    return jsonify({
+        'from': from_epoch(start_ts).strftime('%Y-%m-%d'),
+        'to': (from_epoch(end_ts) - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'computed_at': rows[0]['computed_at'],
+        'devices': [
+            {k: row[k] for k in ('device', 'charges', 'long_offline', 'samples')}
+            for row in rows
+        ]
+    })
+
+@app.route('/api/offline')
+def offline_report():
+    """Devices with no ping for ?hours= (default OFFLINE_AFTER_HOURS) as of
+    ?as_of= (default now), longest silent first, and the longest offline
+    periods on record. Both lists are index walks, up to ?limit= rows each."""
+    hours = request.args.get('hours', app.config['OFFLINE_AFTER_HOURS'], type=float)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    try:
+        as_of = pd.to_datetime(request.args['as_of']) if 'as_of' in request.args else pd.Timestamp.now()
+    except ValueError:
+        abort(400)
+    if as_of.tzinfo is not None:
+        as_of = as_of.tz_convert(None)  # stored epoch seconds are naive, read as UTC
+    as_of_ts = int(to_epoch(as_of))
+    cutoff = as_of_ts - int(hours * 3600)
+
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        tracked = cur.execute('SELECT COUNT(*) FROM device_status').fetchone()[0]
+        offline_count = cur.execute('SELECT COUNT(*) FROM device_status WHERE last_ts < ?', (cutoff,)).fetchone()[0]
+        offline = cur.execute('''
+            SELECT device, last_ts, last_voltage FROM device_status
+            WHERE last_ts < ?
+            ORDER BY last_ts LIMIT ?
+        ''', (cutoff, limit)).fetchall()
+        gaps = cur.execute('''
+            SELECT device, start_ts, end_ts, duration FROM offline_periods
+            WHERE duration >= ?
+            ORDER BY duration DESC LIMIT ?
+        ''', (hours * 3600, limit)).fetchall()
+
+    return jsonify({
+        'as_of': as_of.isoformat(timespec='seconds'),
+        'offline_after_hours': hours,
+        'devices': tracked,
+        'offline_count': offline_count,
+        'currently_offline': [
+            {
+                'device': row['device'],
+                'last_seen': from_epoch(row['last_ts']).isoformat(),
+                'offline_hours': round((as_of_ts - row['last_ts']) / 3600, 1),
+                'last_voltage': row['last_voltage'],
+            }
+            for row in offline
+        ],
+        'longest_gaps': [
+            {
+                'device': row['device'],
+                'last_seen': from_epoch(row['start_ts']).isoformat(),
+                'back_online': from_epoch(row['end_ts']).isoformat(),
+                'hours': round(row['duration'] / 3600, 1),
+            }
+            for row in gaps
+        ],
+    })
 
 @app.route('/region-search', methods=['GET', 'POST'])
+@data_etag
 def region_search():
-    upload_success = False
+    job_id = None
 
     if request.method == 'POST' and 'file' in request.files:
         file = request.files['file']
         if file and allowed_file(file.filename):
             try:
-                filename = secure_filename(f"{uuid.uuid4()}.csv")
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-               
-                init_device_info_table()
-                import_device_info(file_path)
-                upload_success = True
-                os.remove(file_path)
+                file_path, _, read_options = save_upload(file, kinds=('device_info',))
+                job_id = submit_import(import_device_info, file_path, **read_options)
             except Exception as e:
-                return render_template_string(REGION_TEMPLATE,
-                                           error_message=f"Error uploading file: {str(e)}")
-
-    # Load device_info and calculate counts
-    with sqlite3.connect(DB_NAME) as conn:
-        # Ensure table exists before querying
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS device_info (
-                device TEXT PRIMARY KEY,
-                region TEXT,
-                branch TEXT,
-                sim_type TEXT
-            )
-        ''')
-   
-        try:
-            df = pd.read_sql_query('SELECT * FROM device_info', conn)
-        except pd.io.sql.DatabaseError:
-            df = pd.DataFrame(columns=['device', 'region', 'branch', 'sim_type'])
-
-        # Calculate counts
-        total_devices = len(df)
-        region_count = df['region'].nunique()
-       
-        # Get device count per region
-        regions_with_counts = df.groupby('region').size().reset_index(name='count')
-        regions_with_counts = regions_with_counts.to_dict('records')
-
-    return render_template_string(
-        REGION_TEMPLATE,
-        upload_success=upload_success,
-        data=df.to_dict(orient='records'),
+                return render_template(REGION_PAGE,
+                                       error_message=f"Error uploading file: {str(e)}")
+
+    # Only the per-region summary is rendered; the filters load from the JSON API
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        total_devices = cur.execute('SELECT COUNT(*) FROM device_info').fetchone()[0]
+        regions_with_counts = [dict(row) for row in region_counts(cur)]
+
+    return render_template(
+        REGION_PAGE,
+        job_id=job_id,
         total_devices=total_devices,
-        region_count=region_count,
+        region_count=len(regions_with_counts),
         regions_with_counts=regions_with_counts
     )
+
+def region_counts(cur):
+    return cur.execute('''
+        SELECT region, COUNT(*) AS count FROM device_info
+        WHERE region IS NOT NULL
+        GROUP BY region ORDER BY region
+    ''').fetchall()
+
+@app.route('/api/regions')
+@data_etag
+def api_regions():
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        return jsonify([dict(row) for row in region_counts(cur)])
+
+@app.route('/api/branches')
+@data_etag
+def api_branches():
+    region = request.args.get('region')
+    if not region:
+        abort(400)
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        rows = cur.execute('''
+            SELECT branch, COUNT(*) AS count FROM device_info
+            WHERE region = ? AND branch IS NOT NULL
+            GROUP BY branch ORDER BY branch
+        ''', (region,)).fetchall()
+    return jsonify([dict(row) for row in rows])
+
+@app.route('/api/devices')
+@data_etag
+def api_devices():
+    region = request.args.get('region')
+    branch = request.args.get('branch')
+    if not region or not branch:
+        abort(400)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+
+    with get_db() as conn:
+        cur = row_cursor(conn)
+        total = cur.execute(
+            'SELECT COUNT(*) FROM device_info WHERE region = ? AND branch = ?', (region, branch)
+        ).fetchone()[0]
+        rows = cur.execute('''
+            SELECT device, sim_type FROM device_info
+            WHERE region = ? AND branch = ?
+            ORDER BY device LIMIT ? OFFSET ?
+        ''', (region, branch, per_page, (page - 1) * per_page)).fetchall()
+
+    return jsonify({
+        'devices': [dict(row) for row in rows],
+        'page': page,
+        'per_page': per_page,
+        'total': total
+    })
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the database schema; run before the web workers start."""
+    init_db()
+    init_device_info_table()
+    with get_db() as conn:
+        fail_orphaned_import_jobs(conn)
+    click.echo(f"Database {DB_NAME} is up to date")
+
+@app.cli.command('batch-charges')
+@click.option('--from', 'from_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='First day to analyse (default: first day of last month).')
+@click.option('--to', 'to_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Last day to analyse (default: last day of last month).')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: all cores).')
+def batch_charges_command(from_date, to_date, workers):
+    """Compute charge and long-offline counts for every device."""
+    last_month_end = date.today().replace(day=1) - timedelta(days=1)
+    from_date = pd.Timestamp(from_date or last_month_end.replace(day=1))
+    to_date = pd.Timestamp(to_date or last_month_end)
+
+    init_db()
+    start_ts, end_ts = date_range_bounds(from_date, to_date)
+    devices = run_charge_batch(start_ts, end_ts, workers=workers)
+    click.echo(f"Summarized {devices} device(s) from {from_date:%Y-%m-%d} to {to_date:%Y-%m-%d}")
+
+@app.cli.command('archive-gps')
+@click.option('--days', type=int, default=None,
+              help='Archive months that ended at least this many days ago (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--vacuum', is_flag=True, help='Compact the database file afterwards.')
+def archive_gps_command(days, vacuum):
+    """Move cold gps_data months into the Parquet archive."""
+    init_db()
+    with get_db() as conn:
+        moved = archive_gps_data(conn, days if days is not None else app.config['ARCHIVE_AFTER_DAYS'])
+        boundary = archived_before(conn)
+        if vacuum:
+            conn.execute('VACUUM')
+    message = f"Archived {moved} row(s)"
+    if boundary is not None:
+        message += f"; gps_data now starts at {from_epoch(boundary):%Y-%m-%d}"
+    click.echo(message)
+
+@app.cli.command('rebuild-offline')
+def rebuild_offline_command():
+    """Recompute offline_periods and device_status, e.g. after changing OFFLINE_GAP_MINUTES."""
+    init_db()
+    with get_db() as conn:
+        backfill_offline_periods(conn)
+        bump_data_version(conn)
+        periods = conn.execute('SELECT COUNT(*) FROM offline_periods').fetchone()[0]
+    click.echo(f"Recorded {periods} offline period(s) of {app.config['OFFLINE_GAP_MINUTES']}+ minutes")
+
 if __name__ == '__main__':
+    init_db()
+    init_device_info_table()
     app.run(debug=True)
 
 
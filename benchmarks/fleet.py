@@ -0,0 +1,109 @@
+"""Deterministic synthetic fleet telemetry for benchmarks.
+
+Every device pings each `step_minutes` with a few seconds of jitter. Its
+battery discharges steadily until it is plugged in. Charging then jumps the
+voltage and ramps it up to full over one to three hours. Now and then the
+device goes offline for a few hours to a few days. A device's series depends
+only on the seed and its index, so the same arguments always write the same
+file.
+
+    python benchmarks/fleet.py fleet.csv --devices 100 --days 30 --date-format ddmmyyyy
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+DATE_FORMATS = {
+    'mmddyyyy': '%m/%d/%Y %I:%M:%S %p',
+    'ddmmyyyy': '%d/%m/%Y %H:%M:%S',
+}
+CSV_COLUMNS = ['Sl. No', 'Device', 'Event Type', 'Tracking Date', 'Battery Voltage']
+EVENTS = np.array(['G_PING', 'IGN_ON', 'REBOOT'])
+EVENT_WEIGHTS = [0.9, 0.08, 0.02]
+START = pd.Timestamp('2024-01-01')
+
+
+def device_series(rng, days, step_minutes):
+    """Second offsets from START, voltages and event codes of one device."""
+    samples = days * 24 * 60 // step_minutes
+    per_hour = 60 / step_minutes
+    offsets = np.arange(samples) * step_minutes * 60 + rng.integers(0, 30, size=samples)
+
+    voltages = np.empty(samples)
+    level = rng.uniform(3.7, 4.1)
+    i = 0
+    while i < samples:
+        # Discharge for 6 to 60 hours, never below the cut-off
+        length = min(int(rng.uniform(6, 60) * per_hour), samples - i)
+        drop = rng.uniform(0.005, 0.02) / per_hour
+        voltages[i:i + length] = np.maximum(level - drop * np.arange(length), 3.3)
+        level = voltages[i + length - 1]
+        i += length
+
+        # Plugged in: an immediate jump, then a ramp to full over 1 to 3 hours
+        length = min(int(rng.uniform(1, 3) * per_hour), samples - i)
+        if length == 0:
+            break
+        jump = rng.uniform(0.2, 0.4)
+        full = rng.uniform(4.0, 4.2)
+        ramp = np.linspace(min(level + jump, full), full, length)
+        voltages[i:i + length] = ramp
+        level = ramp[-1]
+        i += length
+    voltages += rng.normal(0, 0.005, size=samples)
+
+    # About one outage every ten days, lasting 2 to 72 hours
+    online = np.ones(samples, dtype=bool)
+    for start in rng.integers(0, samples, size=rng.poisson(days / 10)):
+        online[start:start + int(rng.uniform(2, 72) * per_hour)] = False
+
+    events = rng.choice(len(EVENTS), size=samples, p=EVENT_WEIGHTS)
+    return offsets[online], voltages[online].round(3), events[online]
+
+
+def fleet_frames(devices, days=30, step_minutes=5, date_format='mmddyyyy', seed=0, devices_per_frame=50):
+    """Yield the fleet as CSV-shaped DataFrames of `devices_per_frame` devices each."""
+    fmt = DATE_FORMATS[date_format]
+    sl_no = 1
+    for first in range(0, devices, devices_per_frame):
+        frames = []
+        for device in range(first, min(first + devices_per_frame, devices)):
+            offsets, voltages, events = device_series(np.random.default_rng([seed, device]), days, step_minutes)
+            frames.append(pd.DataFrame({
+                'Device': f'DEV{device:06d}',
+                'Event Type': EVENTS[events],
+                'Tracking Date': (START + pd.to_timedelta(offsets, unit='s')).strftime(fmt),
+                'Battery Voltage': voltages,
+            }))
+        frame = pd.concat(frames, ignore_index=True)
+        frame.insert(0, 'Sl. No', np.arange(sl_no, sl_no + len(frame)))
+        sl_no += len(frame)
+        yield frame
+
+
+def write_fleet_csv(path, devices, **kwargs):
+    """Write the fleet to `path` and return the number of rows."""
+    rows = 0
+    for i, frame in enumerate(fleet_frames(devices, **kwargs)):
+        frame.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        rows += len(frame)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic fleet telemetry CSV.')
+    parser.add_argument('path')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--step-minutes', type=int, default=5)
+    parser.add_argument('--date-format', choices=sorted(DATE_FORMATS), default='mmddyyyy')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rows = write_fleet_csv(args.path, args.devices, days=args.days, step_minutes=args.step_minutes,
+                           date_format=args.date_format, seed=args.seed)
+    print(f'Wrote {rows} rows for {args.devices} devices to {args.path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Time ingest, search, comparison, charge detection and charting at several fleet sizes.
+
+    python benchmarks/run.py --scales 10k,1M,10M --output results.json
+
+Each scale (and date format) runs in a fresh process against a new database
+that is filled from a synthetic fleet CSV (see fleet.py). The CSV is cached in
+--data-dir between runs. Results are JSON tagged with the git commit, so
+files from different commits can be compared.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from fleet import write_fleet_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROWS_PER_DEVICE_DAY = 24 * 60  # before the step and outages thin it out
+
+
+def parse_scale(text):
+    """'10k' -> 10000, '1M' -> 1000000."""
+    multipliers = {'k': 10 ** 3, 'm': 10 ** 6}
+    text = text.strip().lower()
+    if text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+def latency_summary(seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        'count': len(ms),
+        'median_ms': float(np.median(ms)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def run_stages(csv_path, date_format, samples):
+    """Build a database from `csv_path` in a scratch directory, deleted
+    afterwards, and time each stage."""
+    with tempfile.TemporaryDirectory(prefix='asset-tracker-bench-') as workdir:
+        os.chdir(workdir)
+        try:
+            return time_stages(csv_path, date_format, samples)
+        finally:
+            os.chdir(ROOT)
+
+
+def time_stages(csv_path, date_format, samples):
+    sys.path.insert(0, ROOT)
+    import app
+
+    app.init_db()
+    app.init_device_info_table()
+    ingest_seconds, stats = timed(lambda: app.import_csv(csv_path, date_format))
+
+    with app.get_db() as conn:
+        first_ts, last_ts = conn.execute('SELECT MIN(ts), MAX(ts) FROM gps_data').fetchone()
+        devices = [device for (device,) in conn.execute('SELECT device FROM devices ORDER BY id')]
+    rng = np.random.default_rng(0)
+    picked = list(rng.choice(devices, size=min(samples, len(devices)), replace=False))
+    first_day, last_day = app.from_epoch(first_ts), app.from_epoch(last_ts)
+
+    client = app.app.test_client()
+    form = {'from_date': f'{first_day:%d/%m/%Y}', 'to_date': f'{last_day:%d/%m/%Y}'}
+    # Searched with GET, as the page does
+    search = [timed(lambda: client.get('/tracker', query_string={**form, 'device': device}))[0] for device in picked]
+    search_cached = [timed(lambda: client.get('/tracker', query_string={**form, 'device': device}))[0]
+                     for device in picked]
+
+    chart_range = f'from={first_day:%Y-%m-%d}&to={last_day:%Y-%m-%d}'
+    chart = [timed(lambda: client.get(f'/api/devices/{device}/timeseries?{chart_range}'))[0] for device in picked]
+
+    # The same devices in one comparison search, table and chart, against the per-device sums above
+    compare_args = {**form, 'compare': 1, 'devices': ','.join(picked)}
+    compare_seconds = timed(lambda: (
+        client.get('/tracker', query_string=compare_args),
+        client.get(f"/api/compare/timeseries?devices={','.join(picked)}&{chart_range}")
+    ))[0]
+
+    # Charge detection over every device, with the reads kept out of the timing
+    with app.get_db() as conn:
+        series = [(ts.astype('datetime64[s]'), voltages)
+                  for _, ts, voltages in app.iter_device_series(conn, first_ts, last_ts + 1)]
+    charges_seconds, cycles = timed(lambda: sum(len(app.find_charge_cycles(times, voltages)[0])
+                                                for times, voltages in series))
+
+    result = {
+        'rows': stats['rows'],
+        'devices': len(devices),
+        'ingest': {
+            'seconds': ingest_seconds,
+            'rows_per_second': stats['rows'] / ingest_seconds,
+            'dates_fast': stats['dates_fast'],
+            'dates_fallback': stats['dates_fallback'],
+        },
+        'search': latency_summary(search),
+        'search_cached': latency_summary(search_cached),
+        'chart': latency_summary(chart),
+        'compare': {
+            'devices': len(picked),
+            'seconds': compare_seconds,
+            'separate_seconds': sum(search) + sum(chart),
+        },
+        'charges': {
+            'seconds': charges_seconds,
+            'rows_per_second': stats['rows'] / charges_seconds,
+            'cycles': cycles,
+        },
+    }
+    app.get_db().close()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='10k,1M,10M', help='Comma separated row counts, e.g. 10k,1M.')
+    parser.add_argument('--date-formats', default='mmddyyyy', help='Comma separated: mmddyyyy, ddmmyyyy.')
+    parser.add_argument('--days', type=int, default=30, help='Days of telemetry per device.')
+    parser.add_argument('--step-minutes', type=int, default=5, help='Ping interval.')
+    parser.add_argument('--samples', type=int, default=20, help='Devices searched and charted per scale.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'asset-tracker-fleets'))
+    parser.add_argument('--output', help='Write the JSON here instead of stdout.')
+    parser.add_argument('--stage-run', nargs=3, metavar=('CSV', 'DATE_FORMAT', 'SAMPLES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage_run:
+        csv_path, date_format, samples = args.stage_run
+        print(json.dumps(run_stages(csv_path, date_format, int(samples))))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    rows_per_device = ROWS_PER_DEVICE_DAY * args.days // args.step_minutes
+    runs = []
+    for scale in args.scales.split(','):
+        devices = max(1, math.ceil(parse_scale(scale) / rows_per_device))
+        for date_format in args.date_formats.split(','):
+            csv_path = os.path.join(args.data_dir, f'fleet-{devices}x{args.days}d-{args.step_minutes}m-'
+                                                   f'{date_format}-seed{args.seed}.csv')
+            if not os.path.exists(csv_path):
+                print(f'Generating {devices} device(s) for {scale} -> {csv_path}', file=sys.stderr)
+                write_fleet_csv(csv_path + '.tmp', devices, days=args.days, step_minutes=args.step_minutes,
+                                date_format=date_format, seed=args.seed)
+                os.replace(csv_path + '.tmp', csv_path)
+
+            print(f'Running {scale} ({date_format})', file=sys.stderr)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--stage-run', csv_path, date_format, str(args.samples)],
+                capture_output=True, text=True, check=True
+            )
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            runs.append({'scale': scale, 'date_format': date_format, **result})
+
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'params': {'days': args.days, 'step_minutes': args.step_minutes, 'samples': args.samples, 'seed': args.seed},
+        'runs': runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
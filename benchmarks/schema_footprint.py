@@ -0,0 +1,128 @@
+"""Disk and memory footprint of gps_data: the previous text schema against the compact one.
+
+Builds both layouts from the same synthetic telemetry and prints JSON with
+the database size, the in-memory size of one import chunk, and the peak
+memory and time of loading one device's full history.
+
+    python benchmarks/schema_footprint.py --devices 200 --days 30
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from fleet import fleet_frames
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LEGACY_SCHEMA = (
+    '''
+    CREATE TABLE gps_data (
+        sl_no INTEGER,
+        device TEXT,
+        event TEXT,
+        ts INTEGER,
+        battery_voltage REAL
+    )
+    ''',
+    'CREATE UNIQUE INDEX idx_device_ts ON gps_data(device, ts, sl_no)',
+)
+
+
+def raw_chunk(app, devices, days, step_minutes):
+    """The fleet as import_csv reads it: stored columns only, text as strings."""
+    frame = pd.concat(fleet_frames(devices, days=days, step_minutes=step_minutes), ignore_index=True)
+    names = [app.GPS_COLUMN_MAPPING.get(c, c) for c in app.normalize_columns(frame.columns)]
+    return frame.set_axis(names, axis=1)[app.GPS_REQUIRED_COLUMNS].astype({'sl_no': 'int64'})
+
+
+def db_bytes(conn, path):
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(path)
+
+
+def traced(load):
+    """Peak traced allocation, wall time and result of `load()`."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--step-minutes', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='schema-footprint-')
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app
+
+    raw = raw_chunk(app, args.devices, args.days, args.step_minutes)
+    fmt = app.sniff_date_format(raw['tracking_date'])
+    compact, _, _ = app.parse_gps_chunk(raw.copy(), fmt)
+    # What the previous parse_gps_chunk produced: names as Python strings
+    legacy = compact.astype({'device': str, 'event': str})
+    device = legacy['device'].iloc[0]
+
+    legacy_path = os.path.join(workdir, 'legacy.db')
+    legacy_conn = sqlite3.connect(legacy_path)
+    for statement in LEGACY_SCHEMA:
+        legacy_conn.execute(statement)
+    legacy_conn.executemany(
+        'INSERT OR IGNORE INTO gps_data (sl_no, device, event, ts, battery_voltage) VALUES (?, ?, ?, ?, ?)',
+        legacy[['sl_no', 'device', 'event', 'ts', 'battery_voltage']].itertuples(index=False, name=None)
+    )
+
+    compact_path = os.path.join(workdir, app.DB_NAME)
+    compact_conn = sqlite3.connect(compact_path)
+    for statement in app.GPS_SCHEMA:
+        compact_conn.execute(statement)
+    compact_conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)')
+    app.insert_gps_rows(compact_conn, compact)
+
+    legacy_peak, legacy_seconds, legacy_frame = traced(lambda: pd.read_sql_query(
+        'SELECT sl_no, device, event, ts, battery_voltage FROM gps_data WHERE device = ? ORDER BY ts',
+        legacy_conn, params=(device,)
+    ))
+    compact_peak, compact_seconds, compact_frame = traced(lambda: pd.read_sql_query(
+        'SELECT sl_no, device, event, ts, battery_voltage FROM gps_readings WHERE device = ? ORDER BY ts',
+        compact_conn, params=(device,), dtype={'device': 'category', 'event': 'category'}
+    ))
+
+    print(json.dumps({
+        'rows': len(raw),
+        'devices': args.devices,
+        'legacy': {
+            'db_bytes': db_bytes(legacy_conn, legacy_path),
+            'chunk_bytes': int(legacy.memory_usage(deep=True).sum()),
+            'device_read_peak_bytes': legacy_peak,
+            'device_read_frame_bytes': int(legacy_frame.memory_usage(deep=True).sum()),
+            'device_read_seconds': legacy_seconds,
+        },
+        'compact': {
+            'db_bytes': db_bytes(compact_conn, compact_path),
+            'chunk_bytes': int(compact.memory_usage(deep=True).sum()),
+            'device_read_peak_bytes': compact_peak,
+            'device_read_frame_bytes': int(compact_frame.memory_usage(deep=True).sum()),
+            'device_read_seconds': compact_seconds,
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
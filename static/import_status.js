@@ -0,0 +1,33 @@
+// Poll the background import job until it finishes
+(function () {
+  const el = document.getElementById('import-status');
+  if (!el) return;
+
+  function poll() {
+    fetch(el.dataset.jobUrl).then(r => r.json()).then(job => {
+      const elapsed = job.elapsed_seconds === null ? '' : ` in ${job.elapsed_seconds.toFixed(0)}s`;
+      const duplicates = job.rows_read - job.rows_rejected - job.rows_inserted - job.rows_archived;
+      if (job.status === 'done') {
+        el.className = 'alert alert-success';
+        el.textContent = `✅ File imported${elapsed}: ${job.rows_inserted} new row(s) added, ` +
+                         `${duplicates} duplicate(s) skipped, ${job.rows_rejected} rejected.`;
+        if (job.rows_archived) {
+          el.textContent += ` ${job.rows_archived} row(s) fall in months already moved to the archive ` +
+                            `and were not imported.`;
+        }
+        if (job.dates_fallback) {
+          el.textContent += ` ${job.dates_fallback} date(s) did not match ${job.date_format || 'a known format'} ` +
+                            `and were parsed individually.`;
+        }
+      } else if (job.status === 'failed') {
+        el.className = 'alert alert-danger';
+        el.textContent = `Error processing file: ${job.error}`;
+      } else {
+        el.textContent = job.status === 'queued' ? '⏳ Import queued…' :
+          `⏳ Importing… ${job.rows_read} row(s) read, ${job.rows_rejected} rejected${elapsed}`;
+        setTimeout(poll, 1000);
+      }
+    }).catch(() => setTimeout(poll, 3000));
+  }
+  poll();
+})();
@@ -0,0 +1,88 @@
+"""detect_charges against the per-sample loop it replaced, on seeded random series."""
+import os
+import sys
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+
+def reference_detect_charges(df, rise_threshold=0.15, window=3):
+    """detect_charges as it was before find_charge_cycles, output formatting aside."""
+    df = df.sort_values('tracking_date').reset_index(drop=True)
+    voltages = df['battery_voltage'].tolist()
+    timestamps = df['tracking_date'].tolist()
+    raw_charges = []
+    i = 0
+
+    while i < len(voltages) - window:
+        start_voltage = voltages[i]
+        end_voltage = voltages[i + window]
+
+        if pd.notna(start_voltage) and pd.notna(end_voltage) and end_voltage - start_voltage >= rise_threshold:
+            max_voltage = max(voltages[i:i+window+1])
+            max_index = i + voltages[i:i+window+1].index(max_voltage)
+            raw_charges.append({
+                'start_time_dt': timestamps[i],
+                'end_time_dt': timestamps[max_index],
+                'start_voltage': start_voltage,
+                'max_voltage': max_voltage,
+            })
+            i = max_index
+        else:
+            i += 1
+
+    merged_charges = []
+    for charge in raw_charges:
+        if merged_charges and charge['start_time_dt'] - merged_charges[-1]['end_time_dt'] <= timedelta(minutes=60):
+            last = merged_charges[-1]
+            last['end_time_dt'] = max(last['end_time_dt'], charge['end_time_dt'])
+            last['max_voltage'] = max(last['max_voltage'], charge['max_voltage'])
+            last['start_voltage'] = min(last['start_voltage'], charge['start_voltage'])
+        else:
+            merged_charges.append(charge)
+
+    for charge in merged_charges:
+        days_offline = (charge['end_time_dt'] - charge['start_time_dt']).total_seconds() / (24 * 3600)
+        charge['is_long_offline'] = days_offline >= 2
+    return merged_charges
+
+
+def random_series(rng):
+    """Irregularly spaced, noisy discharge/charge voltages with some readings missing."""
+    n = int(rng.integers(0, 400))
+    steps = rng.choice([60, 300, 900, 3600, 3 * 86400], size=n, p=[0.2, 0.5, 0.2, 0.08, 0.02])
+    times = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.cumsum(steps), unit='s')
+    changes = rng.normal(-0.01, 0.03, size=n)
+    changes[rng.random(n) < 0.05] += rng.uniform(0.1, 0.5)  # plugged in
+    voltages = np.round(4.0 + np.cumsum(changes), 3)
+    voltages[rng.random(n) < 0.03] = np.nan
+    return pd.DataFrame({'tracking_date': times, 'battery_voltage': voltages})
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_matches_reference_loop(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        df = random_series(rng)
+        window = int(rng.integers(1, 6))
+        rise_threshold = float(rng.choice([0.05, 0.1, 0.15, 0.3]))
+
+        expected = reference_detect_charges(df, rise_threshold=rise_threshold, window=window)
+        actual = app.detect_charges(df, rise_threshold=rise_threshold, window=window)
+
+        assert len(actual) == len(expected)
+        for got, want in zip(actual, expected):
+            for key in ('start_time_dt', 'end_time_dt', 'start_voltage', 'max_voltage', 'is_long_offline'):
+                assert got[key] == want[key], key
+
+
+def test_find_charge_cycles_short_series():
+    starts, peaks, start_voltages, max_voltages = app.find_charge_cycles(
+        np.array(['2024-01-01T00:00'] * 3, dtype='datetime64[s]'), [3.7, 3.9, 4.1]
+    )
+    assert len(starts) == len(peaks) == len(start_voltages) == len(max_voltages) == 0